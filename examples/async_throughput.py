@@ -0,0 +1,46 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+# Async pipeline sample: calling HTTP service for each record with different concurrency limits.
+# A local stub server with fixed latency is started, so throughput should grow almost linearly with concurrency.
+
+import asyncio
+import threading
+import time
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import mPyPl as mp
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(0.05) # simulated model latency
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(self.path.encode())
+
+    def log_message(self, *args):
+        pass
+
+class StubServer(ThreadingHTTPServer):
+    request_queue_size = 128
+
+server = StubServer(('127.0.0.1',0),StubHandler)
+threading.Thread(target=server.serve_forever,daemon=True).start()
+url = 'http://127.0.0.1:{}/'.format(server.server_port)
+
+def call_service(x):
+    with urllib.request.urlopen(url+str(x)) as r:
+        return r.read()
+
+n = 128
+for concurrency in [1,2,4,8,16,32]:
+    t = time.time()
+    res = asyncio.run(range(n)
+                      | mp.as_field('x')
+                      | mp.aapply('x','res',call_service,concurrency=concurrency)
+                      | mp.aas_list)
+    t = time.time()-t
+    print("concurrency={:3}: {:7.1f} records/sec".format(concurrency,n/t))
+
+server.shutdown()
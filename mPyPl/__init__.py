@@ -3,16 +3,48 @@
 
 __version__ = '0.0.3.9'
 
+import importlib
+import os.path as _os_path
+
 from .mdict import *
 from .core import *
 from .funcs import *
-from .video import  *
 from .keras import *
-from .sink import *
 from .sources import *
 from .jsonstream import *
 from .multiclass_datastream import *
 from .xmlstream import *
+from .asyncpipe import *
+from .columnar import *
+from .profiler import *
+from .records import *
 from .utils.pipeutils import *
 from .utils.coreutils import *
 from .sources import *
+
+# Names from modules that depend on heavy libraries (OpenCV, PIL, matplotlib), which are imported on first use
+_lazy_names = {
+    'video' : '.video', 'sink' : '.sink',
+    'load_video' : '.video', 'videosource' : '.video', 'videosource_chunked' : '.video', 'chunk_slide' : '.video',
+    'collect_video' : '.video', 'im_resize' : '.video', 'video_to_npy' : '.video', 'video_cache' : '.video',
+    'resize_video' : '.video', 'dense_optical_flow' : '.video', 'flow_to_hsv' : '.video',
+    'naive_stabilization' : '.video', 'flow_to_polar' : '.video',
+    'write_csv' : '.sink', 'write_json' : '.sink', 'pshow_images' : '.sink', 'show_images' : '.sink',
+    # names that used to be re-exported from `video` module
+    'cv2' : '.video', 'Image' : '.video', 'GifImagePlugin' : '.video', 'LRUCache' : '.video', 'npy_sliding_window' : '.video'
+}
+# `os.path` helpers (`join`, `basename`, `isfile`, ...) were also re-exported from `video` module
+_lazy_names.update((n,'os.path') for n in _os_path.__all__ if n not in globals())
+
+__all__ = [n for n in globals() if not n.startswith('_') and n!='importlib'] + list(_lazy_names)
+
+def __getattr__(name):
+    if name not in _lazy_names:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    mod = importlib.import_module(_lazy_names[name], __name__)
+    v = mod if name in ('video','sink') else getattr(mod, name)
+    globals()[name] = v
+    return v
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_names))
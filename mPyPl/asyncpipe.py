@@ -0,0 +1,146 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+# Asynchronous pipeline operations, useful for I/O-bound processing (eg. calling web services for each record)
+
+import asyncio
+import collections
+import concurrent.futures
+from inspect import iscoroutinefunction, isawaitable
+from pipe import Pipe
+from .core import __fextract
+from .keras import as_batch
+
+async def as_async(l):
+    """
+    Convert a sequence (or async generator) into async generator, so that it can be used in async pipeline.
+    :param l: Input sequence or async generator
+    :return: async generator
+    """
+    if hasattr(l,'__aiter__'):
+        async for x in l:
+            yield x
+    else:
+        for x in l:
+            yield x
+
+async def __acall(func,arg,executor):
+    """
+    Internal. Call `func` on `arg`. Coroutine functions are awaited, ordinary functions are run in the `executor`,
+    so that they do not block the event loop.
+    """
+    if executor is None:
+        return await func(arg)
+    r = await asyncio.get_running_loop().run_in_executor(executor,func,arg)
+    if isawaitable(r):
+        r = await r
+    return r
+
+async def __amap(datastream,src_field,func,concurrency,ordered):
+    """
+    Internal. Compute `func` on `src_field` of each element, with at most `concurrency` calls running at the same time.
+    Yields pairs `(x,result)`.
+    """
+    pending = collections.deque() if ordered else {}
+    executor = None if iscoroutinefunction(func) else concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        async for x in as_async(datastream):
+            t = asyncio.ensure_future(__acall(func,__fextract(x,src_field),executor))
+            if ordered:
+                pending.append((x,t))
+                if len(pending)>=concurrency:
+                    x,t = pending.popleft()
+                    yield x, await t
+            else:
+                pending[t] = x
+                if len(pending)>=concurrency:
+                    done, _ = await asyncio.wait(pending.keys(),return_when=asyncio.FIRST_COMPLETED)
+                    for t in done:
+                        yield pending.pop(t), t.result()
+        if ordered:
+            while len(pending)>0:
+                x,t = pending.popleft()
+                yield x, await t
+        else:
+            while len(pending)>0:
+                done, _ = await asyncio.wait(pending.keys(),return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    yield pending.pop(t), t.result()
+    finally:
+        for t in (pending.keys() if isinstance(pending,dict) else (t for _,t in pending)):
+            t.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+@Pipe
+async def aapply(datastream, src_field, dst_field, func, concurrency=16, ordered=True):
+    """
+    Asynchronous version of `apply`. Sample usage:
+    `asyncio.run(get_datastream(...) | aapply('filename','result',call_service,concurrency=32) | aas_list)`
+    :param datastream: input datastream (sequence or async generator)
+    :param src_field: source field or list of fields
+    :param dst_field: destination field. If `None`, function is just executed and the result is discarded.
+    :param func: coroutine function or ordinary function (which is then run on a pool of `concurrency` threads)
+    :param concurrency: maximum number of calls running at the same time
+    :param ordered: preserve the order of the input stream. If `False`, elements are returned as soon as they are computed
+    :return: async datastream
+    """
+    async for x,r in __amap(datastream,src_field,func,concurrency,ordered):
+        if dst_field is not None and dst_field!='':
+            x[dst_field] = r
+        yield x
+
+@Pipe
+async def afilter(datastream, src_field, pred, concurrency=16, ordered=True):
+    """
+    Asynchronous version of `filter`. Predicate can be a coroutine function or an ordinary function.
+    :param datastream: input datastream (sequence or async generator)
+    :param src_field: field of list of fields to consider
+    :param pred: predicate function
+    :param concurrency: maximum number of predicate calls running at the same time
+    :param ordered: preserve the order of the input stream
+    :return: async datastream with elements that yield predicate
+    """
+    async for x,r in __amap(datastream,src_field,pred,concurrency,ordered):
+        if r:
+            yield x
+
+@Pipe
+async def aas_batch(flow, feature_field_name='features', label_field_name='label', batchsize=16):
+    """
+    Asynchronous version of `as_batch`
+    :return: async sequence of batches
+    """
+    b = []
+    async for x in as_async(flow):
+        b.append(x)
+        if len(b)==batchsize:
+            for r in b | as_batch(feature_field_name,label_field_name,batchsize):
+                yield r
+            b = []
+    if len(b)>0:
+        for r in b | as_batch(feature_field_name,label_field_name,batchsize):
+            yield r
+
+@Pipe
+async def afirst(l):
+    """
+    Returns first element of an async pipe. Should be awaited.
+    """
+    async for x in as_async(l):
+        return x
+
+@Pipe
+async def aas_list(l):
+    """
+    Convert async pipe into a list. Should be awaited.
+    """
+    return [x async for x in as_async(l)]
+
+@Pipe
+async def aexecute(l):
+    """
+    Runs all elements of the async pipeline, ignoring the result. Should be awaited.
+    """
+    async for _ in as_async(l):
+        pass
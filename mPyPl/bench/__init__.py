@@ -0,0 +1,4 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+# Performance benchmarks for mPyPl
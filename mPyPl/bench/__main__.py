@@ -0,0 +1,69 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+"""
+Run micro-benchmarks of core operators and compare them with the stored baseline:
+`python -m mPyPl.bench --output bench.json --baseline baseline.json --threshold 0.1`
+Use `--save-baseline baseline.json` to store current results as a new baseline.
+Exits with non-zero code if any benchmark is slower than the baseline by more than the threshold.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import numpy as np
+import mPyPl
+from .operators import benchmarks, run_all, compare
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m mPyPl.bench', description='Micro-benchmarks of mPyPl operators')
+    parser.add_argument('--sizes', default='1000,100000', help='comma-separated list of stream sizes')
+    parser.add_argument('--fields', default='1,10', help='comma-separated list of field counts')
+    parser.add_argument('--only', default=None, help='comma-separated list of benchmarks to run. Available: ' + ', '.join(benchmarks.keys()))
+    parser.add_argument('--repeat', type=int, default=3, help='number of repetitions (best time is used)')
+    parser.add_argument('--output', default=None, help='JSON file to save results to')
+    parser.add_argument('--baseline', default=None, help='JSON file with baseline results to compare with')
+    parser.add_argument('--save-baseline', default=None, help='JSON file to save results to as a new baseline')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative slowdown compared to baseline')
+    args = parser.parse_args(args)
+
+    names = args.only.split(',') if args.only else None
+    if names is not None and 'iterate' not in names:
+        names = ['iterate'] + names
+    results = run_all(sizes=[int(x) for x in args.sizes.split(',')],
+                      fields=[int(x) for x in args.fields.split(',')],
+                      names=names, repeat=args.repeat)
+
+    print("{:40} {:>14} {:>12} {:>12}".format('benchmark', 'records/sec', 'ns/record', 'overhead ns'))
+    for k, v in results.items():
+        print("{:40} {:>14,.0f} {:>12.1f} {:>12.1f}".format(k, v['records_per_sec'], v['ns_per_record'], v['overhead_ns']))
+
+    doc = {
+        'meta' : {
+            'mPyPl' : mPyPl.__version__,
+            'python' : platform.python_version(),
+            'numpy' : np.__version__,
+            'platform' : platform.platform()
+        },
+        'results' : results
+    }
+    for fn in [args.output, args.save_baseline]:
+        if fn is not None:
+            with open(fn, 'w') as f:
+                json.dump(doc, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("Regressions (more than {:.0%} slower than baseline):".format(args.threshold))
+            for k, b, c, r in regressions:
+                print(" + {}: {:,.0f} -> {:,.0f} records/sec ({:.0%})".format(k, b, c, r))
+            return 1
+        print("No regressions compared to baseline")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
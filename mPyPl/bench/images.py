@@ -0,0 +1,83 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+"""
+Benchmark of image loading: per-record `im_load` in `apply` compared with `im_load_batch` in `apply_batch`.
+Synthetic JPEG images are generated in a temporary directory:
+`python -m mPyPl.bench.images --images 256 --source-size 1024x768 --size 150 --workers 1,2,4`
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from .. import core
+from ..keras import as_batch
+from ..utils.image import im_load, im_load_batch
+
+def make_images(path, n, width, height):
+    """
+    Generate `n` JPEG images of given size with smooth random content
+    :return: list of file names
+    """
+    rng = np.random.default_rng(0)
+    fns = []
+    for i in range(n):
+        small = rng.integers(0, 256, size=(height//32+1, width//32+1, 3), dtype=np.uint8)
+        img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+        fn = os.path.join(path, 'img{}.jpg'.format(i))
+        cv2.imwrite(fn, img)
+        fns.append(fn)
+    return fns
+
+def run_per_record(fns, size, pad_color, batchsize):
+    s = [{ 'filename' : fn } for fn in fns] \
+        | core.apply('filename', 'image', lambda fn: im_load(fn, size, pad_color)) \
+        | as_batch('image', 'image', batchsize=batchsize)
+    return sum(len(b[0]) for b in s)
+
+def run_batched(fns, size, pad_color, batchsize, workers):
+    s = [{ 'filename' : fn } for fn in fns] \
+        | core.apply_batch('filename', 'image', lambda x: im_load_batch(x, size, pad_color, workers=workers), batch_size=batchsize) \
+        | as_batch('image', 'image', batchsize=batchsize)
+    return sum(len(b[0]) for b in s)
+
+def best_time(f, repeat):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        f()
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m mPyPl.bench.images', description='Per-record vs. batched image loading')
+    parser.add_argument('--images', type=int, default=256, help='number of images')
+    parser.add_argument('--source-size', default='1024x768', help='size of source images, WxH')
+    parser.add_argument('--size', type=int, default=150, help='target (square) image size')
+    parser.add_argument('--pad', action='store_true', help='use padding instead of stretching')
+    parser.add_argument('--batchsize', type=int, default=32, help='batch size')
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated list of numbers of threads for im_load_batch')
+    parser.add_argument('--repeat', type=int, default=3, help='number of repetitions (best time is used)')
+    args = parser.parse_args(args)
+
+    width, height = [int(x) for x in args.source_size.split('x')]
+    size = (args.size, args.size)
+    pad_color = 0 if args.pad else None
+    print("CPU count: {}".format(os.cpu_count()))
+    with tempfile.TemporaryDirectory() as path:
+        fns = make_images(path, args.images, width, height)
+        base = best_time(lambda: run_per_record(fns, size, pad_color, args.batchsize), args.repeat)
+        print("{:24} {:>12} {:>10}".format('method', 'images/sec', 'speedup'))
+        print("{:24} {:>12.1f} {:>10.2f}".format('im_load', args.images / base, 1.0))
+        for w in [int(x) for x in args.workers.split(',')]:
+            t = best_time(lambda: run_batched(fns, size, pad_color, args.batchsize, w), args.repeat)
+            print("{:24} {:>12.1f} {:>10.2f}".format('im_load_batch({})'.format(w), args.images / t, base / t))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+"""
+Memory benchmark of record types. Measures the number of bytes per record taken by `mdict` and compact `cmdict`
+for CSV-like rows with a given number of fields (field values themselves are shared and not counted):
+`python -m mPyPl.bench.memory --records 100000 --fields 1,5,20`
+"""
+
+import argparse
+import sys
+import tracemalloc
+from ..mdict import mdict, cmdict, Schema
+
+def bytes_per_record(factory, n, fields):
+    """
+    Measure memory allocated per record when creating `n` records using `factory(names,values)`
+    """
+    names = ['field{}'.format(i) for i in range(fields)]
+    values = ['value{}'.format(i) for i in range(fields)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = [factory(names, values) for _ in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return (after - before) / n
+
+def measure(n=100000, fields=(1, 5, 20)):
+    """
+    Measure bytes per record for `mdict` and `cmdict`
+    :return: dictionary of the form `{ fields : { 'mdict' : bytes, 'cmdict' : bytes }, ...}`
+    """
+    res = {}
+    for f in fields:
+        schema = Schema(['field{}'.format(i) for i in range(f)])
+        res[f] = {
+            'mdict' : bytes_per_record(lambda k, v: mdict(zip(k, v)), n, f),
+            'cmdict' : bytes_per_record(lambda k, v: cmdict(schema, v), n, f)
+        }
+    return res
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Memory per record for mdict and cmdict')
+    parser.add_argument('--records', type=int, default=100000, help='number of records to create')
+    parser.add_argument('--fields', default='1,5,20', help='comma-separated list of field counts')
+    args = parser.parse_args(args)
+    res = measure(args.records, [int(x) for x in args.fields.split(',')])
+    print("{:>8} {:>14} {:>14} {:>8}".format('fields', 'mdict B/rec', 'cmdict B/rec', 'ratio'))
+    for f, r in res.items():
+        print("{:>8} {:>14.1f} {:>14.1f} {:>8.2f}".format(f, r['mdict'], r['cmdict'], r['mdict'] / r['cmdict']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+"""
+Micro-benchmarks of core pipeline operators. Each benchmark runs an operator on a synthetic in-memory stream of
+`mdict`s, and measures the number of records processed per second, as well as per-record overhead compared to just
+iterating over the same stream.
+"""
+
+import time
+from .. import core
+from ..mdict import mdict, EvalStrategies
+from ..keras import as_batch
+from ..utils.pipeutils import pbatch, execute
+
+def make_stream(n, fields):
+    """
+    Create synthetic stream of `n` records with `fields` integer fields `f0`, `f1`, ..., and field `seq` containing
+    short list (used by `unroll`)
+    """
+    res = []
+    for i in range(n):
+        m = mdict({ 'f{}'.format(j) : i+j for j in range(fields) })
+        m['seq'] = [i, i+1, i+2, i+3]
+        res.append(m)
+    return res
+
+def make_lazy_stream(n, fields):
+    """
+    Create synthetic stream where all fields are lazy (`OnDemand`), to measure lazy access path of `mdict`
+    """
+    res = []
+    for i in range(n):
+        m = mdict()
+        for j in range(fields):
+            f = 'f{}'.format(j)
+            m[f] = (lambda v: lambda: v)(i+j)
+            m.set_eval_strategy(f, EvalStrategies.OnDemand)
+        res.append(m)
+    return res
+
+def _read_all(l):
+    for x in l:
+        for k in x.keys():
+            x[k]
+        yield x
+
+"""
+Benchmarks: name -> (stream factory, pipeline to apply to the stream)
+"""
+benchmarks = {
+    'iterate' : (make_stream, lambda s: s),
+    'apply' : (make_stream, lambda s: s | core.apply('f0', 'r', lambda x: x)),
+    'sapply' : (make_stream, lambda s: s | core.sapply('f0', lambda x: x)),
+    'lzapply' : (make_stream, lambda s: s | core.lzapply('f0', 'r', lambda x: x) | core.select_field('r')),
+    'filter' : (make_stream, lambda s: s | core.filter('f0', lambda x: True)),
+    'unroll' : (make_stream, lambda s: s | core.unroll('seq')),
+    'select_fields' : (make_stream, lambda s: s | core.select_fields(['f0'])),
+    'apply_batch' : (make_stream, lambda s: s | core.apply_batch('f0', 'r', lambda x: x, batch_size=32)),
+    'pbatch' : (make_stream, lambda s: s | pbatch(32)),
+    'as_batch' : (make_stream, lambda s: s | as_batch('f0', 'f0', batchsize=32)),
+    'mdict_get' : (make_stream, _read_all),
+    'mdict_lazy_get' : (make_lazy_stream, _read_all),
+}
+
+def run_benchmark(name, n, fields, repeat=3):
+    """
+    Run one benchmark
+    :param name: name of the benchmark from `benchmarks`
+    :param n: number of records in the stream
+    :param fields: number of fields in each record
+    :param repeat: number of repetitions, best time is used
+    :return: best time in seconds
+    """
+    factory, pipeline = benchmarks[name]
+    best = None
+    for _ in range(repeat):
+        data = factory(n, fields)
+        t = time.perf_counter()
+        pipeline(iter(data)) | execute
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+def run_all(sizes=(1000, 100000), fields=(1, 10), names=None, repeat=3):
+    """
+    Run all benchmarks for all combinations of stream sizes and field counts.
+    :return: dictionary of the form `{ 'apply/n=1000/fields=1' : { 'records_per_sec' : ..., 'ns_per_record' : ..., 'overhead_ns' : ...}, ...}`
+    """
+    names = list(benchmarks.keys()) if names is None else names
+    res = {}
+    for n in sizes:
+        for f in fields:
+            base = run_benchmark('iterate', n, f, repeat)
+            for name in names:
+                t = base if name == 'iterate' else run_benchmark(name, n, f, repeat)
+                res['{}/n={}/fields={}'.format(name, n, f)] = {
+                    'records_per_sec' : n / t,
+                    'ns_per_record' : t / n * 1e9,
+                    'overhead_ns' : (t - base) / n * 1e9
+                }
+    return res
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Compare benchmark results with the baseline.
+    :param results: results of `run_all`
+    :param baseline: baseline results in the same format
+    :param threshold: allowed relative slowdown, eg. 0.1 means that 10% lower throughput is not considered a regression
+    :return: list of tuples `(name, baseline records/sec, current records/sec, ratio)` for regressed benchmarks
+    """
+    regressions = []
+    for k, v in results.items():
+        if k in baseline:
+            ratio = v['records_per_sec'] / baseline[k]['records_per_sec']
+            if ratio < 1 - threshold:
+                regressions.append((k, baseline[k]['records_per_sec'], v['records_per_sec'], ratio))
+    return regressions
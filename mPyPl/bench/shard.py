@@ -0,0 +1,95 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+"""
+Benchmark of source-level sharding with several local worker processes. Each worker reads its shard of a synthetic
+dataset (`shard=(k,n)` parameter of the source), and computes a CPU-bound function for each record. For comparison,
+the same is done with `batch(k,n)` placed after the computation, in which case each worker processes the whole stream:
+`python -m mPyPl.bench.shard --workers 1,2,4 --records 20000 --source csv`
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from .. import core
+from ..sources import csvsource
+from ..multiclass_datastream import get_datastream
+
+def work(x, cost):
+    s = 0
+    for i in range(cost):
+        s += (x+i)*(x+i)%7
+    return s
+
+def make_dataset(path, source, records):
+    """
+    Create synthetic dataset: CSV file with `records` lines, or directory with two classes of `records` files in total
+    """
+    if source == 'csv':
+        with open(os.path.join(path, 'data.csv'), 'w') as f:
+            f.write('id,x\n')
+            for i in range(records):
+                f.write('{},{}\n'.format(i, i % 1000))
+        return
+    for c in ['a', 'b']:
+        os.makedirs(os.path.join(path, c))
+    for i in range(records):
+        open(os.path.join(path, 'ab'[i % 2], 'f{}.txt'.format(i)), 'w').close()
+
+def make_source(source, path):
+    """
+    Return source function, which takes `shard` argument and returns a datastream with integer `x` field
+    """
+    if source == 'csv':
+        fn = os.path.join(path, 'data.csv')
+        return lambda shard: csvsource(fn, shard=shard) | core.apply('x', 'x', int)
+    return lambda shard: get_datastream(path, classes={ 'a' : 0, 'b' : 1 }, shard=shard) \
+                         | core.apply('filename', 'x', lambda fn: len(fn))
+
+def run_worker(args):
+    source, path, cost, k, n, mode = args
+    src = make_source(source, path)
+    if mode == 'shard':
+        s = src((k, n)) | core.apply('x', 'r', lambda x: work(x, cost))
+    else:
+        s = src(None) | core.apply('x', 'r', lambda x: work(x, cost)) | core.batch(k, n)
+    return sum(1 for _ in s)
+
+def run(source, path, cost, n, mode):
+    """
+    Process the dataset with `n` worker processes
+    :return: tuple `(wall time in seconds, total number of records processed)`
+    """
+    t = time.perf_counter()
+    with multiprocessing.Pool(n) as pool:
+        counts = pool.map(run_worker, [(source, path, cost, k, n, mode) for k in range(n)])
+    return time.perf_counter() - t, sum(counts)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m mPyPl.bench.shard', description='Source-level sharding with local worker processes')
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated list of numbers of worker processes')
+    parser.add_argument('--records', type=int, default=20000, help='number of records')
+    parser.add_argument('--cost', type=int, default=200, help='amount of CPU work per record')
+    parser.add_argument('--source', default='csv', choices=['csv', 'files'], help='type of data source')
+    args = parser.parse_args(args)
+
+    print("CPU count: {}".format(os.cpu_count()))
+    print("{:>8} {:>8} {:>10} {:>10} {:>10}".format('workers', 'mode', 'records', 'time s', 'speedup'))
+    with tempfile.TemporaryDirectory() as path:
+        make_dataset(path, args.source, args.records)
+        for mode in ['shard', 'batch']:
+            base = None
+            for n in [int(x) for x in args.workers.split(',')]:
+                t, cnt = run(args.source, path, args.cost, n, mode)
+                base = t if base is None else base
+                print("{:>8} {:>8} {:>10} {:>10.3f} {:>10.2f}".format(n, mode, cnt, t, base / t))
+                if cnt != args.records:
+                    print("Records lost or duplicated")
+                    return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
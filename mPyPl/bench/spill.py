@@ -0,0 +1,73 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+"""
+Check that out-of-core `stratify_sample` respects memory budget. Streams synthetic records with numpy payload through
+`stratify_sample(memory_budget=...)` and measures peak traced memory. Payload is stored either as one array field,
+or nested (list of arrays and bytes inside nested `mdict`):
+`python -m mPyPl.bench.spill --records 2000 --payload 65536 --budget 16000000`
+Exits with non-zero code if peak memory exceeds the budget (plus fixed allowance for bookkeeping and one in-flight
+record), or if the result differs from in-memory `stratify_sample`.
+"""
+
+import argparse
+import sys
+import tracemalloc
+import numpy as np
+from ..mdict import mdict
+from ..multiclass_datastream import stratify_sample
+
+def make_records(n, payload, classes, nested=False):
+    """
+    Generate `n` records with `class_id` field and `data` field containing `payload` bytes: numpy array, or (if `nested`)
+    nested `mdict` with a list of 4 arrays and a bytes value
+    """
+    for i in range(n):
+        if nested:
+            k = payload // 5
+            data = mdict({ 'frames' : [np.full(k, i % 256, dtype=np.uint8) for _ in range(4)], 'raw' : bytes(payload - 4*k) })
+        else:
+            data = np.full(payload, i % 256, dtype=np.uint8)
+        yield mdict({ 'id' : i, 'class_id' : i % classes, 'data' : data })
+
+def measure(n, payload, classes, budget, nested=False):
+    """
+    Run `stratify_sample` over the generated stream, keeping only ids of the result.
+    :return: tuple `(peak traced memory in bytes, list of result ids)`
+    """
+    tracemalloc.start()
+    try:
+        ids = [x['id'] for x in make_records(n, payload, classes, nested) | stratify_sample(memory_budget=budget)]
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, ids
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m mPyPl.bench.spill', description='Memory use of out-of-core stratify_sample')
+    parser.add_argument('--records', type=int, default=2000, help='number of records')
+    parser.add_argument('--payload', type=int, default=65536, help='size of numpy payload of each record in bytes')
+    parser.add_argument('--classes', type=int, default=5, help='number of classes')
+    parser.add_argument('--budget', type=int, default=16*1024*1024, help='memory budget in bytes')
+    parser.add_argument('--allowance', type=int, default=4*1024*1024, help='allowed overhead above the budget in bytes')
+    args = parser.parse_args(args)
+
+    expected = [x['id'] for x in make_records(args.records, 1, args.classes) | stratify_sample]
+    res = 0
+    for nested in [False, True]:
+        peak, ids = measure(args.records, args.payload, args.classes, args.budget, nested)
+        total = args.records * args.payload
+        print("{} payload: data size: {:,} bytes, budget: {:,} bytes, peak memory: {:,} bytes".format(
+            'Nested' if nested else 'Flat', total, args.budget, peak))
+        if ids != expected:
+            print("Result differs from in-memory stratify_sample")
+            res = 1
+        elif peak > args.budget + args.allowance + 2 * args.payload:
+            print("Memory budget exceeded")
+            res = 1
+        else:
+            print("Memory budget respected")
+    return res
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+"""
+Startup time benchmark. Measures the time of `import mPyPl` in a fresh interpreter and checks that heavy libraries
+(OpenCV, PIL, matplotlib) are not imported. Exits with non-zero code if time budget is exceeded, so it can be used in CI:
+`python -m mPyPl.bench.startup --budget 0.5`
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+heavy_modules = ['cv2', 'PIL', 'matplotlib']
+
+probe = """
+import sys, time, json
+t = time.perf_counter()
+import mPyPl
+t = time.perf_counter()-t
+print(json.dumps({ 'time' : t, 'heavy' : [m for m in %r if m in sys.modules] }))
+""" % (heavy_modules,)
+
+def measure_import(repeat=5):
+    """
+    Measure import time of `mPyPl` in fresh interpreters
+    :param repeat: number of interpreters to start
+    :return: dictionary with `min` and `median` import time (in seconds) and the list of heavy modules imported
+    """
+    times = []
+    heavy = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', probe], check=True, stdout=subprocess.PIPE).stdout
+        r = json.loads(out.decode().strip().splitlines()[-1])
+        times.append(r['time'])
+        heavy = r['heavy']
+    times.sort()
+    return { 'min' : times[0], 'median' : times[len(times)//2], 'heavy' : heavy }
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Measure `import mPyPl` time')
+    parser.add_argument('--budget', type=float, default=0.5, help='maximum allowed import time in seconds (median)')
+    parser.add_argument('--repeat', type=int, default=5, help='number of measurements')
+    args = parser.parse_args(args)
+    r = measure_import(args.repeat)
+    print("import mPyPl: min {:.3f}s, median {:.3f}s (budget {:.3f}s)".format(r['min'], r['median'], args.budget))
+    ok = True
+    if r['heavy']:
+        print("FAIL: heavy modules imported at startup: {}".format(', '.join(r['heavy'])))
+        ok = False
+    if r['median'] > args.budget:
+        print("FAIL: import time is over budget")
+        ok = False
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+"""
+Columnar (block-oriented) execution mode. Instead of one `mdict` per record, the stream carries batches of records,
+each batch being an `mdict` of columns (one numpy array, or list for non-uniform values, per field). Operations on
+columns are vectorized, which avoids per-record generator and dictionary overhead for simple numeric streams.
+Use `as_columns` and `from_columns` to switch between per-record and columnar representation inside one pipeline:
+`csvsource(...) | as_columns(4096) | capply('x','y',np.sqrt) | cfilter('y',lambda y: y>1) | from_columns | ...`
+"""
+
+import numpy as np
+from pipe import Pipe
+from .mdict import mdict
+
+def __mkcolumn(values):
+    """
+    Internal. Convert list of values into a column - numpy array if possible, list otherwise.
+    """
+    try:
+        c = np.asarray(values)
+    except ValueError: # ragged values
+        return list(values)
+    return list(values) if c.dtype==object else c
+
+def __cextract(b,field_name):
+    if isinstance(field_name, list):
+        return [b[key] for key in field_name]
+    else:
+        return b[field_name]
+
+def batch_len(b):
+    """
+    Return number of records in a columnar batch
+    """
+    for v in b.values():
+        return len(v)
+    return 0
+
+@Pipe
+def as_columns(datastream,n=1024,fields=None):
+    """
+    Convert datastream of `mdict`s into a stream of columnar batches of `n` records.
+    :param datastream: input datastream
+    :param n: number of records in a batch
+    :param fields: list of fields to include. Defaults to all fields of the first record
+    :return: stream of `mdict`s of columns
+    """
+    buf = []
+    for x in datastream:
+        if fields is None:
+            fields = list(x.keys())
+        buf.append(x)
+        if len(buf)==n:
+            yield mdict({ f : __mkcolumn([z[f] for z in buf]) for f in fields })
+            buf = []
+    if len(buf)>0:
+        yield mdict({ f : __mkcolumn([z[f] for z in buf]) for f in fields })
+
+@Pipe
+def cas_field(seq,field_name,n=1024):
+    """
+    Columnar counterpart of `as_field`: convert stream of any objects into columnar batches with one field.
+    """
+    buf = []
+    for x in seq:
+        buf.append(x)
+        if len(buf)==n:
+            yield mdict({ field_name : __mkcolumn(buf) })
+            buf = []
+    if len(buf)>0:
+        yield mdict({ field_name : __mkcolumn(buf) })
+
+@Pipe
+def from_columns(batchstream):
+    """
+    Convert stream of columnar batches back into datastream of `mdict`s. Values of one-dimensional numeric columns
+    are converted to Python scalars.
+    """
+    for b in batchstream:
+        keys = list(b.keys())
+        cols = [b[k].tolist() if isinstance(b[k],np.ndarray) and b[k].ndim==1 else b[k] for k in keys]
+        for v in zip(*cols):
+            yield mdict(zip(keys,v))
+
+@Pipe
+def capply(batchstream,src_field,dst_field,func):
+    """
+    Columnar counterpart of `apply`. Function is applied to the whole column (or list of columns, if `src_field`
+    is a list) and should return a column of the same length, eg. `capply('x','y',lambda x: x*x)`.
+    """
+    for b in batchstream:
+        r = func(__cextract(b,src_field))
+        if dst_field is not None and dst_field!='':
+            b[dst_field] = r
+        yield b
+
+@Pipe
+def cfilter(batchstream,src_field,pred):
+    """
+    Columnar counterpart of `filter`. Predicate is applied to the column (or list of columns) and should return boolean
+    mask. Records for which mask is `False` are removed from all columns. Empty batches are skipped.
+    """
+    for b in batchstream:
+        mask = np.asarray(pred(__cextract(b,src_field)),dtype=bool)
+        if mask.all():
+            yield b
+            continue
+        if not mask.any():
+            continue
+        yield mdict({ k : v[mask] if isinstance(v,np.ndarray) else [z for z,m in zip(v,mask) if m] for k,v in b.items() })
+
+@Pipe
+def cselect_field(batchstream,field_name):
+    """
+    Columnar counterpart of `select_field`: returns stream of columns (or lists of columns) of a given field.
+    Use `cselect_field(...) | pconcat` to obtain the stream of individual values.
+    """
+    for b in batchstream:
+        yield __cextract(b,field_name)
+
+@Pipe
+def cfold(batchstream,field_name,func,init_state):
+    """
+    Columnar counterpart of `fold`. Fold function `func` takes a column (or list of columns) and state, and returns
+    new state, eg. `cfold('x',lambda x,s: s+x.sum(),0)`.
+    :return: final state of the fold
+    """
+    s = init_state
+    for b in batchstream:
+        s = func(__cextract(b,field_name),s)
+    return s
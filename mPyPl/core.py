@@ -6,11 +6,14 @@ from .mdict import *
 from pipe import *
 from .utils.pipeutils import *
 from .utils.coreutils import *
-from .utils.video import *
 from .utils.fileutils import *
+from .utils.cache import DiskCache, hash_value, func_fingerprint
+from .utils.spill import SpillGroups
 import builtins
 import functools
 import sys
+import collections
+import concurrent.futures
 
 
 # === Main pipeline operations ===
@@ -46,7 +49,7 @@ def apply(datastream, src_field, dst_field, func,eval_strategy=None):
     This is useful when there are side effects.
     """
     def applier(x):
-        r = (lambda : __fnapply(x,src_field,func)) if lazy_strategy(eval_strategy) else __fnapply(x,src_field,func)
+        r = Thunk(lambda : __fnapply(x,src_field,func)) if lazy_strategy(eval_strategy) else __fnapply(x,src_field,func)
         if dst_field is not None and dst_field!='':
             x[dst_field]=r
             if eval_strategy:
@@ -75,7 +78,7 @@ def fapply(datastream, dst_field, func, eval_strategy=None):
     operating on internals of `dict`
     """
     def applier(x):
-        x[dst_field] = (lambda : func(x)) if lazy_strategy(eval_strategy) else func(x)
+        x[dst_field] = Thunk(lambda : func(x)) if lazy_strategy(eval_strategy) else func(x)
         if eval_strategy:
             x.set_eval_strategy(dst_field,eval_strategy)
         return x
@@ -91,7 +94,7 @@ def lzapply(datastream, src_field, dst_field, func, eval_strategy = None):
     depends on x['f1'].
     """
     def applier(x):
-        x[dst_field] = lambda: __fnapply(x,src_field,func)
+        x[dst_field] = Thunk(lambda: __fnapply(x,src_field,func))
         x.set_eval_strategy(dst_field,eval_strategy)
         return x
     return datastream | select(applier)
@@ -126,7 +129,7 @@ def apply_batch(datastream, src_field, dst_field, func, batch_size=32):
 
 
 @Pipe
-def apply_npy(datastream,src_field, dst_field, func, file_ext=None):
+def apply_npy(datastream,src_field, dst_field, func, file_ext=None, mmap_mode=None):
     """
     A caching apply that computes some function returning numpy array, and stores the result on disk
     :param datastream: datastream
@@ -134,27 +137,62 @@ def apply_npy(datastream,src_field, dst_field, func, file_ext=None):
     :param dst_field: destination field name
     :param func: function to apply, accepts either one argument or list of arguments
     :param file_ext: file extension to use (dst_field+'.npy') by default
+    :param mmap_mode: if not `None` (eg. `'r'`), cached arrays are opened memory-mapped with this mode instead of being
+    read into memory. This is useful for big arrays of which only slices are used later
     :return: processed file stream
     """
     def applier(x,file_ext):
         fn = x['filename'] + file_ext
         if os.path.isfile(fn):
-            return np.load(fn)
+            return np.load(fn,mmap_mode=mmap_mode)
         else:
             res = __fnapply(x,src_field,func)
             np.save(fn,res)
-            return res
+            return res if mmap_mode is None else np.load(fn,mmap_mode=mmap_mode)
     if not file_ext:
         file_ext = dst_field + ".npy"
     return datastream | fapply(dst_field, functools.partial(applier,file_ext=file_ext))
 
+@Pipe
+def cached_apply(datastream, src_field, dst_field, func, cache_dir, key_field=None, version=None, format='npy', mmap_mode=None, max_size=None, eval_strategy=None):
+    """
+    A caching apply that computes some function returning numpy array, and stores the result in a cache directory.
+    Results are keyed by the hash of the source field value(s) (or `key_field` value(s), if given) together with the
+    fingerprint of the function, so the cache is invalidated when the code of `func` itself, its default arguments,
+    values of variables it captures (closure) or `version` change. Changes to other functions that `func` calls by name
+    (eg. `lambda x: extract(x,model)` when `extract` is modified) are not detected - pass new `version` in this case.
+    :param datastream: datastream
+    :param src_field: source field to use as argument. Can be one field or list of fields
+    :param dst_field: destination field name
+    :param func: function to apply, accepts either one argument or list of arguments
+    :param cache_dir: directory to store cached results in
+    :param key_field: field or list of fields to compute cache key from. Use it to avoid hashing big values, eg. `'filename'`.
+    Defaults to `src_field`
+    :param version: version tag of the function, change it to invalidate the cache explicitly (eg. when functions called by `func` change)
+    :param format: `'npy'` (default) or `'npz'` for compressed storage
+    :param mmap_mode: if given (eg. `'r'`), cached `npy` files are opened as memory-mapped arrays
+    :param max_size: maximum size of cache directory in bytes. Least recently used results are evicted when it is exceeded
+    :param eval_strategy: evaluation strategy of the resulting field
+    :return: processed datastream
+    """
+    cache = DiskCache(cache_dir,max_size=max_size,format=format,mmap_mode=mmap_mode)
+    fid = func_fingerprint(func,version)
+    def applier(x):
+        key = hash_value(fid,__fextract(x,src_field if key_field is None else key_field))
+        res = cache.get(key)
+        if res is None:
+            res = __fnapply(x,src_field,func)
+            cache.put(key,res)
+        return res
+    return datastream | fapply(dst_field, applier, eval_strategy=eval_strategy)
+
 @Pipe
 def apply_nx(datastream, src_field, dst_field, func,eval_strategy=None,print_exceptions=False):
     """
     Same as `apply`, but ignores exceptions by just skipping elements with errors.
     """
     def applier(x):
-        r = (lambda : __fnapply(x,src_field,func)) if lazy_strategy(eval_strategy) else __fnapply(x,src_field,func)
+        r = Thunk(lambda : __fnapply(x,src_field,func)) if lazy_strategy(eval_strategy) else __fnapply(x,src_field,func)
         if dst_field is not None and dst_field!='':
             x[dst_field]=r
             if eval_strategy:
@@ -168,6 +206,70 @@ def apply_nx(datastream, src_field, dst_field, func,eval_strategy=None,print_exc
                 print("[mPyPl] Exception: {}".format(sys.exc_info()))
             pass
 
+@Pipe
+def papply(datastream, src_field, dst_field, func, workers=None, mode='thread', ordered=True, max_inflight=None):
+    """
+    Parallel version of `apply`, which computes `func` on a pool of workers. Sample usage:
+    `get_datastream(...) | papply('filename','image',im_load,workers=8) | ...`
+    Source field values are extracted in the calling thread (so lazy fields are evaluated there), and only those values
+    are passed to the workers. If `src_field` is `None`, the whole `mdict` is passed to `func`; in `process` mode it is
+    pickled, so all its fields are evaluated first, and a copy with plain values (and the same evaluation strategies) is
+    sent to the worker. The result is stored into `dst_field` in the calling thread as well.
+    :param datastream: input datastream
+    :param src_field: source field or list of fields, or `None` to pass the whole `mdict`
+    :param dst_field: destination field. If `None`, function is just executed and the result is discarded.
+    :param func: function to apply. In `process` mode it should be picklable, i.e. defined at module level
+    :param workers: number of workers. Defaults to the number of CPUs
+    :param mode: `'thread'` (good for I/O and for functions that release GIL, like `cv2`) or `'process'`
+    :param ordered: preserve the order of the input stream. If `False`, elements are returned as soon as they are computed
+    :param max_inflight: maximum number of elements being processed at the same time, defaults to `2*workers`. This bounds memory usage.
+    :return: processed datastream
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_inflight is None:
+        max_inflight = 2*workers
+    if mode == 'thread':
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    elif mode == 'process':
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError("Unknown papply mode: {}".format(mode))
+
+    def store(x,fut):
+        r = fut.result()
+        if dst_field is not None and dst_field!='':
+            x[dst_field] = r
+        return x
+
+    pending = collections.deque() if ordered else {}
+    try:
+        for x in datastream:
+            arg = __fextract(x,src_field)
+            if mode=='process' and src_field is None and hasattr(x,'clone'):
+                arg = x.clone(list(x.keys())) # evaluate lazy fields, which can not be pickled
+            fut = executor.submit(func,arg)
+            if ordered:
+                pending.append((x,fut))
+                if len(pending)>=max_inflight:
+                    yield store(*pending.popleft())
+            else:
+                pending[fut] = x
+                if len(pending)>=max_inflight:
+                    done, _ = concurrent.futures.wait(pending.keys(),return_when=concurrent.futures.FIRST_COMPLETED)
+                    for f in done:
+                        yield store(pending.pop(f),f)
+        if ordered:
+            while len(pending)>0:
+                yield store(*pending.popleft())
+        else:
+            for f in concurrent.futures.as_completed(list(pending.keys())):
+                yield store(pending.pop(f),f)
+    finally:
+        for f in (pending.keys() if isinstance(pending,builtins.dict) else (f for _,f in pending)):
+            f.cancel()
+        executor.shutdown(wait=True)
+
 
 # ==== Filter =====
 
@@ -218,6 +320,20 @@ def as_fields(datastream,field_names):
     """
     return datastream | select( lambda x : mdict( dict(zip(field_names,x))))
 
+@Pipe
+def as_cmdict(datastream,schema=None):
+    """
+    Convert datastream of `mdict`s into compact `cmdict` records sharing one schema. This saves memory when many small
+    records are kept in memory.
+    :param datastream: input datastream
+    :param schema: `Schema` to use. If `None`, new schema is created for the stream
+    :return: datastream of `cmdict`s
+    """
+    if schema is None:
+        schema = Schema()
+    for x in datastream:
+        yield cmdict.from_mdict(x,schema)
+
 @Pipe
 def ensure_field(datastream,field_name):
     """
@@ -261,15 +377,25 @@ def set_eval_strategy(datastream,field_name,evs):
         yield x
 
 @Pipe
-def dict_group_by(datasteam, field_name):
+def dict_group_by(datasteam, field_name, memory_budget=None, tmp_dir=None):
     """
     Group all the records by the given field name. Returns dictionary that for each value of the field contains lists
     of corresponding `mdict`-s. **Important**: This operation loads whole dataset into memory, so for big data fields
-    it is better to use lazy evaluation.
+    it is better to use lazy evaluation, or to specify `memory_budget`.
     :param datasteam: input datastream
     :param field_name: field name to use
+    :param memory_budget: if specified, records are kept in memory only up to this size (in bytes), and the rest are
+    spilled to a temporary file. In this case `SpillGroups` object is returned, which for each value of the field contains
+    a sequence that supports `len`, indexing and iteration. Records should be picklable. Call `close()` on the result
+    to remove the temporary file
+    :param tmp_dir: directory for temporary file
     :return: dictionary of the form `{ 'value-1' : [ ... ], ...}`
     """
+    if memory_budget is not None:
+        groups = SpillGroups(memory_budget,tmp_dir)
+        for x in datasteam:
+            groups.add(x[field_name],x)
+        return groups
     dict = {}
     for x in datasteam:
         if x[field_name] in dict.keys():
@@ -280,34 +406,61 @@ def dict_group_by(datasteam, field_name):
 
 
 @Pipe
-def sliding_window_npy(seq,field_names,size,cache=10):
+def sliding_window_npy(seq,field_names,size,cache=10,stride=1,dtype=None,copy=True):
     """
     Create a stream of sliding windows from a given stream.
+    Values are accumulated into a caching array, and windows are taken from it using `sliding_window_view`, so each
+    element is copied only once when the window slides. When the caching array is full, only the tail that is needed
+    for the next windows is moved to the beginning.
     :param seq: Input sequence
     :param field_names: Field names to accumulate
     :param size: Size of sliding window
     :param cache: Size of the caching array, in a number of `size`-chunks.
+    :param stride: Number of elements between the starts of consecutive windows. Defaults to 1
+    :param dtype: dtype of resulting arrays. If `None`, dtype of field values is used
+    :param copy: If `True` (default), each window is a separate array. If `False`, windows are views into the caching
+    array, which avoids copying but makes each window valid only until the caching array is next compacted, so they
+    should be consumed right away (eg. by `as_batch`) rather than collected
     :return: mPyPl sequence containing numpy arrays for specified fields
     """
-    cachesize = size*cache
+    cachesize = builtins.max(size*cache,size+stride)
     buffer = None
-    n = 0
+    n = 0 # number of elements in the buffer
+    start = 0 # start of the next window in the buffer
+    skip = 0 # number of elements to skip (if stride>size)
+
+    def windows(n,start):
+        if n<size:
+            return
+        views = { j : np.moveaxis(np.lib.stride_tricks.sliding_window_view(buffer[j][:n],size,axis=0),-1,1)[start::stride]
+                  for j in field_names }
+        for i in range(len(range(start,n-size+1,stride))):
+            yield mdict({ j : views[j][i].copy() if copy else views[j][i] for j in field_names })
+
     for x in seq:
-        data = { i : x[i] for i in field_names }
-        if n==0:
-            buffer = { i : np.zeros((cachesize,)+data[i].shape) for i in field_names }
-        if n<cachesize: # fill mode
-            for i in field_names: buffer[i][n] = data[i]
-            n+=1
-        else: # spit out mode
-            for i in range(cachesize-size):
-                yield mdict( { j : buffer[j][i:i+size] for j in field_names })
-            for i in field_names: buffer[i] = np.roll(buffer[i],(1-n)*size,axis=0)
-            n=size
+        if skip>0:
+            skip-=1
+            continue
+        if buffer is None:
+            buffer = { i : np.empty((cachesize,)+np.shape(x[i]),dtype=np.asarray(x[i]).dtype if dtype is None else dtype)
+                       for i in field_names }
+        if n==cachesize: # spit out mode
+            yield from windows(n,start)
+            start += len(range(start,n-size+1,stride))*stride
+            if start>=n:
+                skip = start-n-1
+                n = start = 0
+                if skip>=0:
+                    continue
+                skip = 0
+            else:
+                for i in field_names: buffer[i][:n-start] = buffer[i][start:n]
+                n,start = n-start,0
+        for i in field_names: buffer[i][n] = x[i]
+        n+=1
     # spit out the rest
-    if n>size:
-        for i in range(n-size):
-            yield mdict( { j : buffer[j][i:i+size] for j in field_names })
+    if buffer is not None:
+        yield from windows(n,start)
 
 
 @Pipe
@@ -492,7 +645,8 @@ def batch(datastream,k,n):
     """
     Separate only part of the stream for parallel batch processing. If you have `n` nodes, pass number of current node
     as `k` (from 0 to n-1), and it will pass only part of the stream to be processed by that node. Namely, for i-th
-    element of the stream, it is passed through if i%n==k
+    element of the stream, it is passed through if i%n==k. Note that all upstream elements are still computed on each node,
+    so it is better to pass `shard=(k,n)` to the data source (eg. `get_datastream`, `csvsource`), if it supports it.
     :param datastream: datastream
     :param k: number of current node in cluster
     :param n: total number of nodes
@@ -2,8 +2,16 @@
 import json
 from .mdict import *
 
-def jsonstream(fn):
+def jsonstream(fn,shard=None):
+    """
+    Create a data source from JSON file containing a list of objects
+    :param fn: Filename
+    :param shard: tuple `(k,n)` to return only every `n`-th object starting from `k`, or `None`
+    :return: Sequence of `mdict` objects
+    """
     with open(fn,'r') as f:
         res = json.load(f)
+    if shard is not None:
+        res = res[shard[0]::shard[1]]
     for x in res:
         yield mdict.to_mdict(x)
@@ -4,36 +4,84 @@
 from pipe import Pipe
 import numpy as np
 
+def __batch_layout(names):
+    """
+    Internal. Convert field specification (field name, list of names or dict `{ input_name : field_name }`) into
+    a list of field names and a function that packs the list of arrays back into the same structure.
+    """
+    if isinstance(names, dict):
+        keys = list(names.keys())
+        return [names[k] for k in keys], lambda a: dict(zip(keys,a))
+    elif isinstance(names, list):
+        return names, list
+    else:
+        return [names], lambda a: a[0]
+
+def __batch_alloc(v, batchsize, dtype=None):
+    """
+    Internal. Allocate batch array for values like `v`, keeping its dtype (promoted with `dtype`, if given).
+    Scalars are stored as arrays of shape `(1,)`.
+    """
+    v = np.asarray(v)
+    return np.empty((batchsize,)+(v.shape if v.ndim>0 else (1,)), dtype=v.dtype if dtype is None else np.result_type(v.dtype,dtype))
+
+def __batch_promote(a, dtype, n):
+    """
+    Internal. Return a copy of batch array `a` with dtype promoted to hold values of `dtype`, keeping first `n` elements
+    """
+    r = np.empty(a.shape, dtype=np.result_type(a.dtype,dtype))
+    r[:n] = a[:n]
+    return r
+
 @Pipe
-def as_batch(flow, feature_field_name='features', label_field_name='label', batchsize=16):
+def as_batch(flow, feature_field_name='features', label_field_name='label', batchsize=16, buffers=None):
     """
     Split input datastream into a sequence of batches suitable for keras training.
-    :param flow: input datastream
-    :param feature_field_name: feature field name to use. can be string or list of strings (for multiple arguments). Defaults to `features`
-    :param label_field_name: Label field name. Defaults to `label`
+    Batch arrays are allocated with the shape and dtype of the first element (eg. `uint8` for images) and filled in place.
+    If a later element can not be cast to this dtype without loss (eg. float label after int one), the batch array is
+    promoted to a common dtype (see `np.result_type`), and subsequent batches use the promoted dtype as well.
+    :param flow: input datastream (any iterable)
+    :param feature_field_name: feature field name to use. Can be string, list of strings (for multiple inputs, yields
+    list of arrays) or dict of the form `{ 'input_name' : 'field_name', ...}` (yields dict of arrays). Defaults to `features`
+    :param label_field_name: Label field name. Can be string, list or dict in the same manner. Defaults to `label`
     :param batchsize: batch size. Defaults to 16.
-    :return: sequence of batches that can be passed to `flow_generator` or similar function in keras
-    """
-    #TODO: Test this function on multiple inputs!
-    batch = labels = None
-    while (True):
-        for i in range(batchsize):
-            data = next(flow)
-            # explicitly compute all fields - this is needed for all fields to be computed only once for on-demand evaluation
-            flds = { i : data[i] for i in (feature_field_name if isinstance(feature_field_name, list) else [feature_field_name])}
-            lbls = data[label_field_name] # TODO: what happens when label_field_name is a list?
-            if batch is None:
-                if isinstance(feature_field_name, list):
-                    batch = [np.zeros((batchsize,)+flds[i].shape) for i in feature_field_name]
-                else:
-                    batch = np.zeros((batchsize,)+flds[feature_field_name].shape)
-                lbls_shape = lbls.shape if lbls is np.ndarray else (1,)
-                labels = np.zeros((batchsize,)+lbls_shape)
-            if isinstance(feature_field_name, list):
-                for j,n in enumerate(feature_field_name):
-                    batch[j][i] = flds[n]
+    :param buffers: If `None` (default), new arrays are allocated for each batch. If a number `n` is given, a ring of `n`
+    preallocated buffers is reused, so each batch is only valid until `n` more batches are produced. Use this when the
+    consumer copies the batch (eg. to GPU) right away.
+    :return: sequence of batches that can be passed to `flow_generator` or similar function in keras. The last batch
+    can be smaller than `batchsize` if the stream is finite.
+    """
+    feature_fields, pack_features = __batch_layout(feature_field_name)
+    label_fields, pack_labels = __batch_layout(label_field_name)
+    fields = feature_fields + label_fields
+    nf = len(feature_fields)
+    ring = []
+    k = 0
+    cur = None
+    i = 0
+    dtypes = [None]*len(fields) # promoted dtypes of fields
+    for data in flow:
+        # explicitly compute all fields - this is needed for all fields to be computed only once for on-demand evaluation
+        vals = [data[f] for f in fields]
+        if cur is None:
+            if buffers is None or len(ring)<buffers:
+                cur = [__batch_alloc(v,batchsize,d) for v,d in zip(vals,dtypes)]
+                if buffers is not None:
+                    ring.append(cur)
             else:
-                batch[i] = flds[feature_field_name]
-            labels[i] = data[label_field_name]
-        yield (batch, labels)
-        batch = labels = None
+                cur = ring[k]
+                k = (k+1)%buffers
+        for j,v in enumerate(vals):
+            a = cur[j]
+            d = v.dtype if isinstance(v,np.ndarray) else np.asarray(v).dtype
+            if d!=a.dtype and not np.can_cast(d,a.dtype,'same_kind'):
+                a = cur[j] = __batch_promote(a,d,i)
+                dtypes[j] = a.dtype
+            a[i] = v
+        i+=1
+        if i==batchsize:
+            yield (pack_features(cur[:nf]), pack_labels(cur[nf:]))
+            cur = None
+            i = 0
+    if i>0: # flush remaining items
+        yield (pack_features([a[:i] for a in cur[:nf]]), pack_labels([a[:i] for a in cur[nf:]]))
@@ -2,6 +2,7 @@
 # http://github.com/shwars/mPyPl
 
 import enum
+import builtins
 from .utils.coreutils import getattritem,encode_csv
 import json
 import numpy as np
@@ -11,6 +12,7 @@ Different evaluation strategies that can be used for `mdict` slots:
   * `Value` - just the value stored as in normal dictionary
   * `LazyMemoized` - a function is stored, which is evaluated upon calling the field with `x[...]`. Result is stored back into the field, so that in is not re-computed again. 
   * `OnDemand` - similar to `LazyMemoized`, but the result is not stored, and function is called each time to get the value. This is very useful for large video objects not to persist in memory.
+Lazy functions are stored wrapped into `Thunk` objects, so any other value (including functions) is stored as `Value`.
 """
 EvalStrategies = enum.Enum('EvalStrategies','Default Value LazyMemoized OnDemand')
 
@@ -22,6 +24,20 @@ def lazy_strategy(eval_strategy):
     """
     return eval_strategy==EvalStrategies.LazyMemoized or eval_strategy==EvalStrategies.OnDemand
 
+class Thunk:
+    """
+    Lazily computed value of an `mdict` slot. The function is called when the slot is accessed, and the result is
+    either stored back into the slot (`LazyMemoized`, which is the default) or recomputed each time (`OnDemand`).
+    Any other value stored in a slot, including functions, is returned as is.
+    """
+    __slots__ = ('func',)
+
+    def __init__(self,func):
+        self.func = func
+
+    def __repr__(self):
+        return 'Thunk({!r})'.format(self.func)
+
 class mdict(dict):
     """
     Base Dictionary class that flows through the pipeline. It supports different evaluation strategies, including
@@ -33,26 +49,30 @@ class mdict(dict):
 
     def set(self,key,value,eval_strategy=None):
         """
-        Set the value of a slot and optionally its evaluation strategy
+        Set the value of a slot and optionally its evaluation strategy. If the strategy is lazy, `value` should be
+        a function without arguments that computes the value.
         """
-        dict.__setitem__(key,value)
+        dict.__setitem__(self,key,value)
         self.set_eval_strategy(key,eval_strategy)
 
 
     def set_eval_strategy(self,key,eval_strategy):
         if eval_strategy is not None:
             self.eval_strategies[key] = eval_strategy
+            if lazy_strategy(eval_strategy):
+                v = dict.get(self,key)
+                if callable(v): # make a plain function stored in the slot lazy
+                    dict.__setitem__(self,key,Thunk(v))
 
 
     def __getitem__(self, item):
         res = dict.__getitem__(self,item)
-        if callable(res) and self.eval_strategies.get(item,EvalStrategies.Default) != EvalStrategies.Value:
-            r = res.__call__()
-            if self.eval_strategies.get(item,EvalStrategies.LazyMemoized) == EvalStrategies.LazyMemoized:
-                self[item] = r
+        if res.__class__ is Thunk:
+            r = res.func()
+            if self.eval_strategies.get(item) != EvalStrategies.OnDemand:
+                dict.__setitem__(self,item,r)
             return r
-        else:
-            return res
+        return res
 
     def get(self, item, default=None):
         return dict.get(self,item,default)
@@ -123,3 +143,190 @@ class mdict(dict):
                 if type(t) is np.ndarray:
                     add += ", shape={}".format(t.shape)
             print(" + {}, eval strategy={}{}".format(x, md.eval_strategies.get(x, None), add))  # TODO: print eval options and type
+
+
+class Schema:
+    """
+    Field layout shared by all `cmdict` records of a stream: maps field names to positions in the values list, and
+    holds evaluation strategies of fields. Schema only grows - new fields are appended when first set on any record.
+    """
+    __slots__ = ('fields','index','eval_strategies','derived')
+
+    def __init__(self,fields=()):
+        self.fields = []
+        self.index = {}
+        self.eval_strategies = {}
+        self.derived = {}
+        for f in fields:
+            self.add(f)
+
+    def subschema(self,fields):
+        """
+        Return schema with a subset of fields, sharing evaluation strategies with this one. Subschemas are cached,
+        so that all records cloned with the same fields share one schema.
+        """
+        fields = tuple(fields)
+        s = self.derived.get(fields)
+        if s is None:
+            s = self.derived[fields] = Schema(fields)
+            s.eval_strategies = self.eval_strategies
+        return s
+
+    def add(self,field):
+        i = self.index.get(field)
+        if i is None:
+            i = self.index[field] = len(self.fields)
+            self.fields.append(field)
+        return i
+
+_missing = object()
+
+class cmdict:
+    """
+    Compact record, that can be used instead of `mdict` for streams of millions of small records (eg. from CSV files).
+    It supports the same interface as `mdict` (field access with evaluation strategies, `keys`, `clone`, etc.),
+    but instead of a dictionary it only holds a list of values, while field names and evaluation strategies are kept
+    in a `Schema` object shared between all records of the stream.
+    """
+    __slots__ = ('schema','data')
+
+    def __init__(self,schema=None,values=None,**kwargs):
+        """
+        Create compact record
+        :param schema: shared `Schema`, or a dictionary to create a record with new schema from
+        :param values: list of values in the order of schema fields
+        """
+        if schema is None or isinstance(schema,dict):
+            d = dict(schema or {},**kwargs)
+            self.schema = Schema(d.keys())
+            self.data = list(d.values())
+        else:
+            self.schema = schema
+            self.data = list(values) if values is not None else []
+            for k,v in kwargs.items():
+                self[k] = v
+
+    @property
+    def eval_strategies(self):
+        return self.schema.eval_strategies
+
+    def set_eval_strategy(self,key,eval_strategy):
+        if eval_strategy is not None:
+            self.schema.eval_strategies[key] = eval_strategy
+            if lazy_strategy(eval_strategy):
+                v = self.get(key)
+                if callable(v): # make a plain function stored in the slot lazy
+                    self[key] = Thunk(v)
+
+    def set(self,key,value,eval_strategy=None):
+        """
+        Set the value of a slot and optionally its evaluation strategy
+        """
+        self[key] = value
+        self.set_eval_strategy(key,eval_strategy)
+
+    def _raw(self,item):
+        i = self.schema.index.get(item)
+        if i is None or i>=len(self.data) or self.data[i] is _missing:
+            raise KeyError(item)
+        return self.data[i]
+
+    def __getitem__(self, item):
+        res = self._raw(item)
+        if res.__class__ is Thunk:
+            r = res.func()
+            if self.schema.eval_strategies.get(item) != EvalStrategies.OnDemand:
+                self[item] = r
+            return r
+        return res
+
+    def __setitem__(self, key, value):
+        i = self.schema.add(key)
+        n = len(self.data)
+        if i<n:
+            self.data[i] = value
+        else:
+            if i>n:
+                self.data.extend([_missing]*(i-n))
+            self.data.append(value)
+
+    def __delitem__(self, key):
+        self._raw(key)
+        self.data[self.schema.index[key]] = _missing
+
+    def __contains__(self, item):
+        i = self.schema.index.get(item)
+        return i is not None and i<len(self.data) and self.data[i] is not _missing
+
+    def __len__(self):
+        return sum(1 for v in self.data if v is not _missing)
+
+    def __iter__(self):
+        return builtins.iter(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other,(cmdict,dict)):
+            return dict(self.items())==dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return 'cmdict({})'.format(dict(self.items()))
+
+    def keys(self):
+        return [f for f,v in zip(self.schema.fields,self.data) if v is not _missing]
+
+    def values(self):
+        """
+        Raw values of fields (lazy fields are not evaluated), in the same way as for `mdict`
+        """
+        return [v for v in self.data if v is not _missing]
+
+    def items(self):
+        return [(f,v) for f,v in zip(self.schema.fields,self.data) if v is not _missing]
+
+    def get(self, item, default=None):
+        try:
+            return self._raw(item)
+        except KeyError:
+            return default
+
+    def as_float(self,item):
+        return float(self[item])
+
+    def as_int(self,item):
+        return int(self[item])
+
+    def as_csv(self,sep=','):
+        return sep.join(map(lambda x: encode_csv(x,sep),self.values()))
+
+    def as_csv_header(self,sep=','):
+        return sep.join(map(lambda x: encode_csv(x,sep),self.keys()))
+
+    def clone(self,fields=None):
+        """
+        Create a copy of the record. If `fields` are given, the copy contains only those fields (evaluated).
+        """
+        if fields is None:
+            return cmdict(self.schema,self.data)
+        return cmdict(self.schema.subschema(fields),[self[k] for k in fields])
+
+    def to_mdict(self):
+        """
+        Convert to `mdict`, preserving raw values and evaluation strategies
+        """
+        m = mdict(self.items())
+        m.eval_strategies = dict(self.schema.eval_strategies)
+        return m
+
+    @staticmethod
+    def from_mdict(x,schema):
+        """
+        Convert `mdict` (or any dictionary) to `cmdict` with a given shared schema
+        """
+        c = cmdict(schema)
+        for k,v in x.items():
+            c[k] = v
+        es = getattr(x,'eval_strategies',None)
+        if es:
+            schema.eval_strategies.update(es)
+        return c
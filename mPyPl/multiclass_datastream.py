@@ -16,15 +16,54 @@ This module expects the following directory structure of files:
 """
 
 import enum
+import concurrent.futures
 from pipe import *
 from .core import *
 from .utils.fileutils import *
 from .utils.coreutils import normalize_npy
+from .utils.spill import SpillGroups
+from .utils.cache import hash_value
 
-SplitType = enum.Enum('SplitType',['Unknown','Train','Test','Valiadation'])
+# `Valiadation` is kept as an alias of `Validation` for compatibility
+SplitType = enum.Enum('SplitType',[('Unknown',1),('Train',2),('Test',3),('Validation',4),('Valiadation',4)])
+
+def split_key(x,key_field=None,streaming=False):
+    """
+    Return the key used for splitting an object: value of `key_field` if it is specified, otherwise base name of `filename`
+    field (if present), otherwise the object itself.
+    :param streaming: if `True`, the key is going to be hashed, so using the whole object as a key is not allowed (it may
+    contain lazy fields that can not be hashed, and the split would depend on unrelated fields). `ValueError` is raised
+    if there is no `filename` field and `key_field` is not specified.
+    """
+    if key_field is not None:
+        return x[key_field]
+    if hasattr(x,'keys') and 'filename' in x.keys():
+        return os.path.basename(x['filename'])
+    if streaming:
+        raise ValueError("Streaming split requires 'filename' field or key_field to be specified")
+    return x
+
+def hash_split_type(key,split_value=0.2,seed=None):
+    """
+    Deterministically assign split type to a key based on its stable hash. The hash does not depend on the process or
+    machine (unlike built-in `hash`), so distributed workers agree on the split without sharing split file. Since each key
+    is assigned independently, fraction of each split within every class approaches the target as the class grows.
+    :param key: key of the object, eg. file base name
+    :param split_value: either one value (fraction of test data), or pair of fractions `(val,test)` in the same way as for `make_split`
+    :param seed: optional seed to obtain different splits of the same data
+    :return: `SplitType`
+    """
+    u = int(hash_value(seed,key)[:16],16)/2**64
+    if isinstance(split_value,tuple):
+        if u<split_value[0]:
+            return SplitType.Test
+        elif u<split_value[0]+split_value[1]:
+            return SplitType.Validation
+        return SplitType.Train
+    return SplitType.Test if u<split_value else SplitType.Train
 
 @Pipe
-def datasplit(datastream,split_param=None,split_value=0.2):
+def datasplit(datastream,split_param=None,split_value=0.2,streaming=False,key_field=None,seed=None):
     """
     Very flexible function for splitting the dataset into train-test or train-test-validation dataset. If datastream
     contains field `filename` - all splitting is performed based on the filename (directories are ommited to simplify
@@ -32,10 +71,14 @@ def datasplit(datastream,split_param=None,split_value=0.2):
     :param datastream: datastream to split
     :param split_param: either filename of 'split.txt' file, or dictionary of filenames. If the file does not exist - stratified split is performed, and file is created. If `split_param` is None, temporary split is performed.
     :param split_value: either one value (default is 0.2), in which case train-test split is performed, or pair of `(validation,test)` values
+    :param streaming: if `True` and split file/dictionary is not given, split of each object is computed from the stable hash of its key
+    (see `hash_split_type`), without loading the whole datastream into memory. The split is the same on every run and every machine.
+    :param key_field: field to use as a key instead of `filename` base name. Required for streaming split if there is no `filename` field
+    :param seed: seed for the hash-based split
     :return: datastream with additional field `split`
     """
     def mktype(x):
-        t = os.path.basename(x['filename']) if 'filename' in x.keys() else x
+        t = split_key(x,key_field)
         if t in dict['Test']:
             return SplitType.Test
         elif t in dict['Train']:
@@ -56,34 +99,45 @@ def datasplit(datastream,split_param=None,split_value=0.2):
     else:
         pass
 
+    if not dict and streaming:
+        return datastream | fapply('split', lambda x: hash_split_type(split_key(x,key_field,True),split_value,seed))
+
     if not dict:
         datastream = list(datastream)
-        dict = make_split(datastream,split_value)
+        dict = make_split(datastream,split_value,key_field=key_field)
         if isinstance(split_param,str):
             write_dict_text(split_param,dict)
 
     return datastream | fapply('split', mktype)
 
 
-def make_split(datastream,split_value=0.2):
+def make_split(datastream,split_value=0.2,streaming=False,key_field=None,seed=None):
     """
     Split datastream into train-validation-test or train-test sets in a stratified manner.
     :param datastream: datastream to use
     :param split_value: if float - indicates fraction of data to be used for test dataset. If typle `(val,test)` - indicates
     fractions used for validation and test split accordingly. Detaults to 0.2.
+    :param streaming: if `True`, each object is assigned to a split by the stable hash of its key (see `hash_split_type`),
+    without grouping the datastream by classes. The result is the same as the one of `datasplit(streaming=True)`.
+    :param key_field: field to use as a key instead of `filename` base name. Required for streaming split if there is no `filename` field
+    :param seed: seed for the hash-based split
     :return: Dictionary with objects split between given datasets. If datastream contains `filename` field, filenames are returned,
     otherwise the actual objects.
     """
     multisplit = isinstance(split_value,tuple)
-    cls = datastream | dict_group_by('class_id')
     if multisplit:
         dict = { 'Train': [], 'Test': [], 'Validation': []}
     else:
         dict = { 'Train': [], 'Test': []}
+    if streaming:
+        for x in datastream:
+            t = split_key(x,key_field,True)
+            dict[hash_split_type(t,split_value,seed).name].append(t)
+        return dict
+    cls = datastream | dict_group_by('class_id')
     for k,v in cls.items():
         random.shuffle(v)
-        if 'filename' in v[0].keys():
-            v = [os.path.basename(x['filename']) for x in v]
+        v = [split_key(x,key_field) for x in v]
         l = len(v)
         if multisplit:
             n1 = int(split_value[0]*l)
@@ -104,19 +158,33 @@ def get_classes(data_dir,include_hidden=False):
     :param data_dir: Base data directory
     :return: Dictionary of the form { 'dir0' : 0, 'dir1' : 1, ... }
     """
-    return { d:n for n,d in enumerate(listdir(data_dir,include_hidden=include_hidden,include_files=False,include_dirs=True))}
+    return { d:n for n,d in builtins.enumerate(listdir(data_dir,include_hidden=include_hidden,include_files=False,include_dirs=True))}
 
-def get_datastream(data_dir, ext=None, classes=None, split_filename=None):
+def get_datastream(data_dir, ext=None, classes=None, split_filename=None, shard=None, recursive=False, workers=None, cache=None):
     """
     Get a stream of objects for a number of classes specified as dict of the form { 'dir0' : 0, 'dir1' : 1, ... }
     Returns stream of dictionaries of the form { class_id: ... , class_name: ..., filename: ... }
     `classes` is the dictionary of the form { 'class_name' : class_id, ... }
+    `shard` is a tuple `(k,n)` to process data on `n` nodes: only files that belong to shard `k` (by stable hash of file name,
+    see `in_shard`) are returned. Unlike `batch`, files of other shards are skipped before any processing.
+    If `recursive` is `True`, files from subdirectories of class directories are included as well.
+    `workers` is the number of threads to list class directories in parallel (useful for network storage), and `cache` is
+    the name of listing cache file (see `ListingCache`), which allows not to re-read directories that have not changed.
     """
     if classes is None:
         classes = get_classes(data_dir)
-    stream = list(classes.items()) \
-            | select(lambda kv: get_files(os.path.join(data_dir,kv[0]),ext)\
-            | select(lambda x: mdict({ "filename": x, "class_id": kv[1], "class_name": kv[0] }))) \
+    c = ListingCache(cache) if isinstance(cache,str) else cache
+    lister = lambda kv: get_files(os.path.join(data_dir,kv[0]),ext,shard,recursive,c)
+    if workers is None:
+        files = [lister(kv) for kv in classes.items()]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(workers) as ex:
+            files = list(ex.map(lister,classes.items()))
+    if isinstance(cache,str):
+        c.save()
+    stream = builtins.zip(classes.items(),files) \
+            | select(lambda kvf: kvf[1]\
+            | select(lambda x: mdict({ "filename": x, "class_id": kvf[0][1], "class_name": kvf[0][0] }))) \
             | chain
     if split_filename:
         return stream | datasplit(os.path.join(data_dir,split_filename))
@@ -225,64 +293,96 @@ def summary(seq,class_field_name='class_name',split_field_name='split'):
     """
     return seq | summarize(field_name=class_field_name,msg="Classes:") | summarize(field_name=split_field_name,msg="Split:")
 
+def __round_robin(data,n,shuffle):
+    """
+    Internal. Yield `n` elements from each of the sequences in dictionary `data` in round robin manner. If `shuffle`
+    is `True`, random `n` elements are taken from each sequence in random order.
+    """
+    keys = list(data.keys())
+    idx = { t : random.sample(range(len(data[t])),n) if shuffle else range(n) for t in keys }
+    for i in range(n):
+        for t in keys:
+            yield data[t][idx[t][i]]
+
 @Pipe
-def stratify_sample(seq,n=None,shuffle=False,field_name='class_id'):
+def stratify_sample(seq,n=None,shuffle=False,field_name='class_id',memory_budget=None,tmp_dir=None):
     """
     Returns stratified samples of size `n` from each class (given dy `field_name`) in round robin manner.
-    NB: This operation is cachy (caches all data in memory)
+    NB: This operation is cachy (caches all data in memory), unless `memory_budget` is specified
     :param l: input pipe generator
     :param n: number of samples or `None` (in which case the min number of elements is used)
     :param shuffle: perform random shuffling of samples
     :param field_name: name of field that specifies classes. `class_no` by default.
+    :param memory_budget: maximum size of records kept in memory (in bytes). If specified, the rest of the records
+    is spilled to a temporary file on disk (records should be picklable).
+    :param tmp_dir: directory for temporary file
     :return: result sequence
     """
-    data = {}
-    for x in seq:
-        t = x[field_name]
-        if t not in data.keys(): data[t] = []
-        data[t].append(x)
-    if n is None:
-        n = builtins.min([len(data[t]) for t in data.keys()])
+    if memory_budget is not None:
+        groups = SpillGroups(memory_budget,tmp_dir)
     else:
-        n = builtins.min(n,builtins.min([len(data[t]) for t in data.keys()]))
-    if shuffle:
-        for t in data.keys(): random.shuffle(data[t])
-    for i in range(n):
-        for t in data.keys():
-            yield data[t][i]
+        groups = {}
+    try:
+        for x in seq:
+            t = x[field_name]
+            if memory_budget is not None:
+                groups.add(t,x)
+            else:
+                if t not in groups.keys(): groups[t] = []
+                groups[t].append(x)
+        data = { t : groups[t] for t in groups.keys() }
+        if n is None:
+            n = builtins.min([len(data[t]) for t in data.keys()])
+        else:
+            n = builtins.min(n,builtins.min([len(data[t]) for t in data.keys()]))
+        yield from __round_robin(data,n,shuffle)
+    finally:
+        if memory_budget is not None:
+            groups.close()
 
 @Pipe
-def stratify_sample_tt(seq,n_samples=None,shuffle=False,class_field_name='class_id',split_field_name='split'):
+def stratify_sample_tt(seq,n_samples=None,shuffle=False,class_field_name='class_id',split_field_name='split',memory_budget=None,tmp_dir=None):
     """
     Returns stratified training, test and validation samples of size `n_sample` from each class
     (given dy `class_field_name`) in round robin manner.
     `n_samples` is a dict specifying number of samples for each split type (or None).
-    NB: This operation is cachy (caches all data in memory)
+    NB: This operation is cachy (caches all data in memory), unless `memory_budget` is specified
     :param l: input pipe generator
     :param n_samples: dict specifying number of samples for each split type or `None` (in which case the min number of elements is used)
     :param shuffle: perform random shuffling of samples
     :param class_field_name: name of field that specifies classes. `class_id` by default.
     :param split_field_name: name of field that specifies split. `split` by default.
+    :param memory_budget: maximum size of records kept in memory (in bytes). If specified, the rest of the records
+    is spilled to a temporary file on disk (records should be picklable).
+    :param tmp_dir: directory for temporary file
     :return: result sequence
     """
     if n_samples is None: n_samples = {}
-    data = {}
-    for x in seq:
-        t = x[class_field_name]
-        s = x[split_field_name]
-        if s not in data.keys(): data[s] = {}
-        if t not in data[s].keys(): data[s][t] = []
-        data[s][t].append(x)
-    for s in data.keys(): # TODO: make sure train data is returned first
-        if n_samples.get(s,None) is None:
-            n = builtins.min([len(data[s][t]) for t in data[s].keys()])
-        else:
-            n = builtins.min(n_samples.get(s),builtins.min([len(data[s][t]) for t in data[s].keys()]))
-        if shuffle:
-            for t in data[s].keys(): random.shuffle(data[s][t])
-        for i in range(n):
-            for t in data[s].keys():
-                yield data[s][t][i]
+    if memory_budget is not None:
+        groups = SpillGroups(memory_budget,tmp_dir)
+    else:
+        groups = {}
+    try:
+        for x in seq:
+            key = (x[split_field_name],x[class_field_name])
+            if memory_budget is not None:
+                groups.add(key,x)
+            else:
+                if key not in groups.keys(): groups[key] = []
+                groups[key].append(x)
+        data = {}
+        for s,t in groups.keys():
+            if s not in data.keys(): data[s] = {}
+            data[s][t] = groups[(s,t)]
+        for s in data.keys(): # TODO: make sure train data is returned first
+            if n_samples.get(s,None) is None:
+                n = builtins.min([len(data[s][t]) for t in data[s].keys()])
+            else:
+                n = builtins.min(n_samples.get(s),builtins.min([len(data[s][t]) for t in data[s].keys()]))
+            yield from __round_robin(data[s],n,shuffle)
+    finally:
+        if memory_budget is not None:
+            groups.close()
 
 @Pipe
 def datasplit_by_pattern(datastream,train_pattern=None,valid_pattern=None,test_pattern=None):
@@ -0,0 +1,187 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+"""
+Per-stage pipeline profiling. Insert `profiled(name)` after the stages you want to measure, for example:
+```
+with profile() as p:
+    get_datastream(...) | profiled('source') \
+        | apply('filename','image',im_load) | profiled('load') \
+        | apply('image','features',model.predict) | profiled('predict') \
+        | execute
+p.print_report()
+```
+Each `profiled` point measures the time spent in pulling elements from upstream. Time spent inside the nearest
+upstream `profiled` point is reported as *blocked* time, and the rest is the *self* time of the stage(s) between two
+profiled points.
+"""
+
+import builtins
+import collections
+import math
+import threading
+import time
+from pipe import Pipe
+
+class LatencyHistogram:
+    """
+    Histogram of latencies with logarithmic bins (10 bins per decade from 100ns to 1000s), used to compute
+    approximate percentiles in constant memory.
+    """
+    bins_per_decade = 10
+    min_latency = 1e-7
+    nbins = 100
+
+    def __init__(self):
+        self.counts = [0]*LatencyHistogram.nbins
+
+    def add(self,t):
+        i = int(math.log10(t/LatencyHistogram.min_latency)*LatencyHistogram.bins_per_decade) if t>LatencyHistogram.min_latency else 0
+        self.counts[min(i,LatencyHistogram.nbins-1)] += 1
+
+    def percentile(self,p):
+        """
+        Return approximate `p`-th percentile (upper bound of the bin), or `None` if histogram is empty
+        """
+        n = sum(self.counts)
+        if n==0:
+            return None
+        k = p/100*n
+        c = 0
+        for i,x in enumerate(self.counts):
+            c += x
+            if c>=k and x>0:
+                return LatencyHistogram.min_latency*10**((i+1)/LatencyHistogram.bins_per_decade)
+        return None
+
+class StageStats:
+    """
+    Statistics of one profiled stage
+    """
+    def __init__(self,profiler,name):
+        self.profiler = profiler
+        self.name = name
+        self.items = 0
+        self.total_time = 0.0
+        self.blocked_time = 0.0
+        self.histogram = LatencyHistogram()
+        self.downstream = None
+
+    def wrap(self,seq):
+        local = self.profiler.local
+        it = builtins.iter(seq)
+        while True:
+            if not hasattr(local,'stack'):
+                local.stack = []
+            stack = local.stack
+            if self.downstream is None and len(stack)>0:
+                self.downstream = stack[-1][0]
+            frame = [self,0.0]
+            stack.append(frame)
+            t = time.perf_counter()
+            try:
+                x = next(it)
+            except StopIteration:
+                return
+            finally:
+                t = time.perf_counter()-t
+                stack.pop()
+                if len(stack)>0:
+                    stack[-1][1] += t
+                self.total_time += t
+                self.blocked_time += frame[1]
+            self.items += 1
+            self.histogram.add(t-frame[1])
+            yield x
+
+class Profiler:
+    """
+    Collection of statistics for profiled stages of a pipeline. Can be used as a context manager, in which case
+    all `profiled` stages created inside the context report to this profiler.
+    """
+    current = None
+    lock = threading.Lock()
+
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self.local = threading.local()
+        self.prev = None
+
+    def stage(self,name):
+        if name not in self.stages:
+            self.stages[name] = StageStats(self,name)
+        return self.stages[name]
+
+    def __enter__(self):
+        with Profiler.lock:
+            self.prev = Profiler.current
+            Profiler.current = self
+        return self
+
+    def __exit__(self,*args):
+        with Profiler.lock:
+            Profiler.current = self.prev
+
+    def report(self):
+        """
+        Return profiling report as dictionary of the form `{ stage_name : { ... }, ... }`. Times are in seconds.
+        For each stage, `items_in` is the number of items produced by profiled stages directly upstream (or `None`
+        if there are none), and `p50`/`p95`/`p99` are percentiles of per-item self time.
+        """
+        res = collections.OrderedDict()
+        for n,s in self.stages.items():
+            ups = [u for u in self.stages.values() if u.downstream is s]
+            self_time = s.total_time-s.blocked_time
+            res[n] = {
+                'items_in' : sum(u.items for u in ups) if len(ups)>0 else None,
+                'items_out' : s.items,
+                'total_time' : s.total_time,
+                'self_time' : self_time,
+                'blocked_time' : s.blocked_time,
+                'items_per_sec' : s.items/self_time if self_time>0 else None,
+                'p50' : s.histogram.percentile(50),
+                'p95' : s.histogram.percentile(95),
+                'p99' : s.histogram.percentile(99)
+            }
+        return res
+
+    def table(self):
+        """
+        Return profiling report as printable table
+        """
+        def fmt(x,scale=1.0,f="{:.3f}"):
+            return '-' if x is None else f.format(x*scale)
+        lines = ["{:20} {:>9} {:>9} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+            'stage','in','out','total s','self s','blocked s','p50 ms','p95 ms','p99 ms')]
+        for n,r in self.report().items():
+            lines.append("{:20} {:>9} {:>9} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+                n[:20],'-' if r['items_in'] is None else r['items_in'],r['items_out'],fmt(r['total_time']),fmt(r['self_time']),
+                fmt(r['blocked_time']),fmt(r['p50'],1000),fmt(r['p95'],1000),fmt(r['p99'],1000)))
+        return '\n'.join(lines)
+
+    def print_report(self):
+        print(self.table())
+
+def profile():
+    """
+    Create new profiler to be used as a context manager: `with profile() as p: ...`
+    """
+    return Profiler()
+
+"""
+Profiler used by `profiled` stages created outside of `with profile():` context
+"""
+default_profiler = Profiler()
+
+@Pipe
+def profiled(datastream,name,profiler=None):
+    """
+    Profile the pipeline up to this point, reporting statistics under a given stage name.
+    :param datastream: input datastream
+    :param name: name of the stage
+    :param profiler: profiler to use. Defaults to the one of the enclosing `with profile():` context, or `default_profiler`
+    :return: the same datastream
+    """
+    if profiler is None:
+        profiler = Profiler.current or default_profiler
+    return profiler.stage(name).wrap(datastream)
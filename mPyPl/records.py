@@ -0,0 +1,322 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+"""
+Sharded binary record format for persisting datastreams, eg. precomputed features. A dataset is a directory with
+`index.json` description, and a number of shard files `shard-NNNNN.rec` of limited size, each accompanied by offset
+index `shard-NNNNN.idx`. Records are written one by one, without loading the datastream into memory:
+```
+get_datastream(...) | apply('filename','features',compute_features) | write_records('features_dir')
+read_records('features_dir',workers=4) | as_batch('features','class_id') | ...
+r = RecordReader('features_dir'); r[1000]
+```
+Fields of each record are pickled, and numpy arrays are stored out-of-band as raw bytes after the pickled data
+(aligned to 64 bytes), so that by default they are memory-mapped from the shard file without copying. Records
+can be optionally compressed with `zlib`, `bz2` or `lzma`.
+"""
+
+import os
+import json
+import mmap
+import struct
+import pickle
+import bisect
+import importlib
+import collections
+import concurrent.futures
+from pipe import Pipe
+from .mdict import mdict
+
+_format_name = 'mpypl-records'
+_format_version = 1
+_compressions = ['zlib','bz2','lzma']
+_align = 64
+# record header: number of out-of-band buffers, size of pickled data
+_header = struct.Struct('<IQ')
+
+def _codec(compression):
+    if compression is None:
+        return None
+    if compression not in _compressions:
+        raise ValueError("Unsupported compression {!r}, should be one of {}".format(compression,_compressions))
+    return importlib.import_module(compression)
+
+def _shard_name(k):
+    return 'shard-{:05d}'.format(k)
+
+class RecordWriter:
+    """
+    Streaming writer of records into sharded dataset directory. Use as context manager, or call `close()` at the end
+    to write the index. Index left from previous write into the same directory is removed when writer is created, and
+    if an exception is raised inside the `with` block, the index is not written, so that incomplete dataset can not be
+    read by mistake:
+    ```
+    with RecordWriter('features_dir') as w:
+        for x in datastream: w.write(x)
+    ```
+    """
+    def __init__(self,path,shard_size=256*1024*1024,compression=None,level=None):
+        """
+        :param path: dataset directory, which is created if it does not exist
+        :param shard_size: maximum size of one shard file in bytes (a shard always contains at least one record)
+        :param compression: `None` (default), `zlib`, `bz2` or `lzma`
+        :param level: compression level, or `None` for default
+        """
+        self.path = path
+        self.shard_size = shard_size
+        self.compression = compression
+        self.codec = _codec(compression)
+        self.level = level
+        self.shards = []
+        self.file = None
+        self.offsets = None
+        os.makedirs(path,exist_ok=True)
+        # stale index from previous write would point to shards that are going to be overwritten
+        fn = os.path.join(path,'index.json')
+        if os.path.exists(fn):
+            os.remove(fn)
+
+    def _compress(self,b):
+        if self.codec is None:
+            return b
+        if self.level is None:
+            return self.codec.compress(b)
+        if self.compression=='lzma': # second positional argument of lzma.compress is format
+            return self.codec.compress(b,preset=self.level)
+        return self.codec.compress(b,self.level)
+
+    def _open_shard(self):
+        self.file = open(os.path.join(self.path,_shard_name(len(self.shards))+'.rec'),'wb')
+        self.offsets = []
+
+    def _close_shard(self):
+        self.offsets.append(self.file.tell())
+        self.file.close()
+        name = _shard_name(len(self.shards))
+        with open(os.path.join(self.path,name+'.idx'),'wb') as f:
+            f.write(struct.pack('<{}Q'.format(len(self.offsets)),*self.offsets))
+        self.shards.append({ 'file' : name, 'count' : len(self.offsets)-1 })
+        self.file = None
+
+    def write(self,x):
+        """
+        Write one record. All fields of `mdict` are evaluated and stored, and the record is read back as `mdict`.
+        """
+        buffers = []
+        data = pickle.dumps({ k : x[k] for k in x.keys() },protocol=5,buffer_callback=buffers.append)
+        buffers = [self._compress(b.raw()) for b in buffers]
+        data = self._compress(data)
+        if self.file is not None and self.file.tell()>0 and self.file.tell()+len(data)+sum(len(b) for b in buffers)>self.shard_size:
+            self._close_shard()
+        if self.file is None:
+            self._open_shard()
+        f = self.file
+        self.offsets.append(f.tell())
+        f.write(_header.pack(len(buffers),len(data)))
+        f.write(struct.pack('<{}Q'.format(len(buffers)),*[len(b) for b in buffers]))
+        f.write(data)
+        for b in buffers:
+            f.write(b'\0'*(-f.tell()%_align))
+            f.write(b)
+        f.write(b'\0'*(-f.tell()%_align))
+
+    def close(self):
+        """
+        Close current shard and write dataset index
+        """
+        if self.file is not None:
+            self._close_shard()
+        fn = os.path.join(self.path,'index.json')
+        with open(fn+'.tmp','w') as f:
+            json.dump({
+                'format' : _format_name,
+                'version' : _format_version,
+                'compression' : self.compression,
+                'count' : sum(s['count'] for s in self.shards),
+                'shards' : self.shards
+            },f,indent=1)
+        os.replace(fn+'.tmp',fn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        if args[0] is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        """
+        Close current shard without writing dataset index
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class RecordReader:
+    """
+    Reader of sharded record dataset written by `RecordWriter` or `write_records`. Supports `len`, access to records
+    by index and iteration. Reader is thread-safe.
+    """
+    def __init__(self,path,mmap_mode='r'):
+        """
+        :param path: dataset directory
+        :param mmap_mode: `'r'` (default) to memory-map shard files, in which case numpy arrays of uncompressed records
+        are read-only views of the file. If `None`, each record is read into memory, and arrays are writable.
+        """
+        self.path = path
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(path,'index.json')) as f:
+            meta = json.load(f)
+        if meta.get('format')!=_format_name or meta.get('version',0)>_format_version:
+            raise ValueError("{} is not a record dataset supported by this version".format(path))
+        self.codec = _codec(meta['compression'])
+        self.shards = [s['file'] for s in meta['shards']]
+        self.offsets = []
+        self.starts = [0]
+        for s in meta['shards']:
+            with open(os.path.join(path,s['file']+'.idx'),'rb') as f:
+                b = f.read()
+            self.offsets.append(struct.unpack('<{}Q'.format(len(b)//8),b))
+            self.starts.append(self.starts[-1]+s['count'])
+        self.maps = {}
+
+    def __len__(self):
+        return self.starts[-1]
+
+    def shard_count(self):
+        return len(self.shards)
+
+    def shard_range(self,k):
+        """
+        Return range of record indices stored in shard `k`
+        """
+        return range(self.starts[k],self.starts[k+1])
+
+    def _locate(self,i):
+        if i<0:
+            i += len(self)
+        if i<0 or i>=len(self):
+            raise IndexError(i)
+        k = bisect.bisect_right(self.starts,i)-1
+        return k,i-self.starts[k]
+
+    def _read(self,k,start,end):
+        fn = os.path.join(self.path,self.shards[k]+'.rec')
+        if self.mmap_mode is None:
+            with open(fn,'rb') as f:
+                f.seek(start)
+                b = bytearray(end-start)
+                f.readinto(b)
+            return memoryview(b)
+        m = self.maps.get(k)
+        if m is None:
+            with open(fn,'rb') as f:
+                m = memoryview(mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ))
+            m = self.maps.setdefault(k,m)
+        return m[start:end]
+
+    def _decode(self,b):
+        nbuf, ndata = _header.unpack_from(b,0)
+        pos = _header.size
+        sizes = struct.unpack_from('<{}Q'.format(nbuf),b,pos)
+        pos += 8*nbuf
+        data = b[pos:pos+ndata]
+        pos += ndata
+        buffers = []
+        for n in sizes:
+            pos += -pos%_align
+            buffers.append(b[pos:pos+n])
+            pos += n
+        if self.codec is not None:
+            data = self.codec.decompress(data)
+            buffers = [bytearray(self.codec.decompress(z)) for z in buffers]
+        return mdict(pickle.loads(data,buffers=buffers))
+
+    def read(self,k,j):
+        """
+        Read record `j` of shard `k`
+        """
+        offs = self.offsets[k]
+        return self._decode(self._read(k,offs[j],offs[j+1]))
+
+    def __getitem__(self,i):
+        return self.read(*self._locate(i))
+
+    def shard(self,k,start=0,end=None):
+        """
+        Iterate over records of shard `k` (optionally, from record `start` to `end` within the shard)
+        """
+        offs = self.offsets[k]
+        end = len(offs)-1 if end is None else end
+        if start>=end:
+            return
+        b = self._read(k,offs[start],offs[end])
+        for j in range(start,end):
+            yield self._decode(b[offs[j]-offs[start]:offs[j+1]-offs[start]])
+
+    def __iter__(self):
+        for k in range(len(self.shards)):
+            yield from self.shard(k)
+
+    def close(self):
+        """
+        Release memory-mapped shard files. Arrays obtained from the reader remain valid.
+        """
+        self.maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+@Pipe
+def write_records(datastream,path,shard_size=256*1024*1024,compression=None,level=None):
+    """
+    Write datastream into sharded record dataset (see `RecordWriter`), without loading it into memory
+    :param datastream: input datastream
+    :param path: dataset directory
+    :param shard_size: maximum size of one shard file in bytes
+    :param compression: `None` (default), `zlib`, `bz2` or `lzma`
+    :param level: compression level
+    :return: number of records written
+    """
+    n = 0
+    with RecordWriter(path,shard_size,compression,level) as w:
+        for x in datastream:
+            w.write(x)
+            n += 1
+    return n
+
+def read_records(path,shards=None,workers=None,block_size=64,mmap_mode='r'):
+    """
+    Read the datastream from sharded record dataset.
+    :param path: dataset directory
+    :param shards: list of shard numbers to read, or `None` to read all shards
+    :param workers: number of threads to read and decode records in parallel (useful for compressed data). Blocks of
+    `block_size` records are read in parallel from different shards, and the order of records is preserved.
+    :param block_size: number of records read by one thread at once
+    :param mmap_mode: `'r'` to memory-map shard files (default), or `None` to read records into memory
+    :return: stream of `mdict`s
+    """
+    with RecordReader(path,mmap_mode) as r:
+        shards = range(r.shard_count()) if shards is None else shards
+        if workers is None:
+            for k in shards:
+                yield from r.shard(k)
+            return
+        blocks = [(k,j,min(j+block_size,len(r.shard_range(k)))) for k in shards for j in range(0,len(r.shard_range(k)),block_size)]
+        inflight = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(workers) as ex:
+            try:
+                for blk in blocks:
+                    inflight.append(ex.submit(lambda b: list(r.shard(*b)),blk))
+                    if len(inflight)>=2*workers:
+                        yield from inflight.popleft().result()
+                while inflight:
+                    yield from inflight.popleft().result()
+            finally:
+                for f in inflight:
+                    f.cancel()
@@ -2,16 +2,46 @@
 # http://github.com/shwars/mPyPl
 
 from .mdict import *
+from .utils.fileutils import byte_range, byte_range_lines
 import csv
+import locale
+import contextlib
 
-def csvsource(fn,sep=',',encoding=None):
+def __csvlines(fn,encoding,shard):
+    """
+    Internal. Yield decoded lines of the CSV file: header line, followed by lines starting within byte range of the shard
+    """
+    encoding = encoding or locale.getpreferredencoding(False)
+    start,end = byte_range(fn,shard)
+    with open(fn,'rb') as f:
+        yield f.readline().decode(encoding)
+        for l in byte_range_lines(f,start,end):
+            yield l.decode(encoding)
+
+def csvsource(fn,sep=',',encoding=None,compact=False,shard=None):
     """
     Create a data source from CSV file
     :param fn: Filename
     :param sep: Separator to use. Defaults to ','
+    :param compact: Produce compact `cmdict` records sharing one schema instead of `mdict`s. Values in excess of the
+    number of header fields are dropped in this case
+    :param shard: tuple `(k,n)` to read only `k`-th of `n` approximately equal byte ranges of the file (lines are assigned
+    to the range in which they start). Only the corresponding part of the file is read, so `n` nodes can process one file
+    in parallel. Quoted values should not contain line breaks in this case.
     :return: Sequence of mdict object representing CSV data. Field names are taken from first line
     """
-    with open(fn, newline='',encoding=encoding) as csvfile:
-        reader = csv.DictReader(csvfile,delimiter=sep)
-        for row in reader:
-            yield mdict(row)
+    with open(fn, newline='',encoding=encoding) if shard is None else contextlib.nullcontext(__csvlines(fn,encoding,shard)) as csvfile:
+        if compact:
+            reader = csv.reader(csvfile,delimiter=sep)
+            schema = Schema(next(reader,[]))
+            n = len(schema.fields)
+            for row in reader:
+                if len(row)<n: # missing values are None, as with csv.DictReader
+                    row += [None]*(n-len(row))
+                elif len(row)>n: # extra values past the header are dropped
+                    del row[n:]
+                yield cmdict(schema,row)
+        else:
+            reader = csv.DictReader(csvfile,delimiter=sep)
+            for row in reader:
+                yield mdict(row)
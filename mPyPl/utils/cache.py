@@ -0,0 +1,275 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+# Caching utilities
+
+import os
+import sys
+import hashlib
+import pickle
+import types
+import functools
+import collections
+import threading
+import numpy as np
+
+def _update_hash(h,v):
+    """
+    Internal. Feed value `v` into hash object `h` in a way that is stable across runs and machines.
+    """
+    if isinstance(v,np.ndarray):
+        h.update(b'ndarray')
+        h.update(str(v.dtype).encode())
+        h.update(str(v.shape).encode())
+        h.update(np.ascontiguousarray(v).tobytes())
+    elif isinstance(v,(list,tuple)):
+        h.update('{}:{}'.format(type(v).__name__,len(v)).encode())
+        for z in v:
+            _update_hash(h,z)
+    elif isinstance(v,bytes):
+        h.update(b'bytes:'+v)
+    elif isinstance(v,(str,int,float,bool,type(None))):
+        h.update('{}:{!r}'.format(type(v).__name__,v).encode())
+    else:
+        h.update(pickle.dumps(v,protocol=4))
+
+def hash_value(*args):
+    """
+    Compute stable hex digest of given values. Supports numpy arrays, lists, tuples, atomic values and any picklable object.
+    :param args: values to hash
+    :return: hex digest string
+    """
+    h = hashlib.sha1()
+    for v in args:
+        _update_hash(h,v)
+    return h.hexdigest()
+
+def _code_fingerprint(h,code):
+    h.update(code.co_code)
+    for c in code.co_consts:
+        if isinstance(c,types.CodeType):
+            _code_fingerprint(h,c)
+        else:
+            h.update(repr(c).encode())
+
+def _value_fingerprint(h,v,seen):
+    """
+    Internal. Feed a value captured by a function (default argument or closure variable) into hash object `h`.
+    Functions are fingerprinted recursively, values that can not be hashed (eg. unpicklable objects) contribute their type only.
+    """
+    if isinstance(v,(types.FunctionType,functools.partial)):
+        _func_fingerprint(h,v,seen)
+    else:
+        try:
+            _update_hash(h,v)
+        except Exception:
+            h.update('unhashable:{}'.format(type(v).__qualname__).encode())
+
+def _func_fingerprint(h,func,seen):
+    while isinstance(func,functools.partial):
+        _update_hash(h,[func.args,sorted(func.keywords.items())])
+        func = func.func
+    h.update('{}.{}'.format(getattr(func,'__module__',None),getattr(func,'__qualname__',type(func).__qualname__)).encode())
+    if id(func) in seen:
+        return
+    seen.add(id(func))
+    code = getattr(func,'__code__',None)
+    if code is not None:
+        _code_fingerprint(h,code)
+    for v in getattr(func,'__defaults__',None) or ():
+        _value_fingerprint(h,v,seen)
+    kwdefaults = getattr(func,'__kwdefaults__',None) or {}
+    for k in sorted(kwdefaults.keys()):
+        h.update(k.encode())
+        _value_fingerprint(h,kwdefaults[k],seen)
+    for c in getattr(func,'__closure__',None) or ():
+        try:
+            v = c.cell_contents
+        except ValueError: # empty cell
+            h.update(b'empty-cell')
+            continue
+        _value_fingerprint(h,v,seen)
+
+def func_fingerprint(func,version=None):
+    """
+    Compute a fingerprint of a function, which changes whenever function name, its code, default argument values,
+    values of closure variables (captured functions are fingerprinted recursively) or `version` changes.
+    It is used to invalidate cached results when the function is modified. Note that functions called by name
+    (eg. module-level helpers) are not included, so use `version` to invalidate the cache when they change.
+    :param func: function (or `functools.partial`, or any callable)
+    :param version: optional version tag to include into the fingerprint
+    :return: hex digest string
+    """
+    h = hashlib.sha1()
+    h.update(repr(version).encode())
+    _func_fingerprint(h,func,set())
+    return h.hexdigest()
+
+class DiskCache:
+    """
+    Cache of numpy arrays stored in a directory, with optional LRU eviction based on the total size of the cache.
+    Recency is tracked through file modification time, so it persists across runs.
+    """
+    formats = { 'npy' : '.npy', 'npz' : '.npz' }
+
+    def __init__(self,cache_dir,max_size=None,format='npy',mmap_mode=None):
+        """
+        Create disk cache
+        :param cache_dir: directory to store cached files in. Created if it does not exist
+        :param max_size: maximum size of the cache in bytes, or `None` for unlimited cache
+        :param format: `'npy'` for plain numpy files, or `'npz'` for compressed ones
+        :param mmap_mode: if not `None`, `npy` files are opened memory-mapped using this mode (eg. `'r'`)
+        """
+        if format not in DiskCache.formats:
+            raise ValueError("Unknown cache format: {}".format(format))
+        if mmap_mode is not None and format!='npy':
+            raise ValueError("mmap_mode is only supported for npy format")
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.format = format
+        self.mmap_mode = mmap_mode
+        self.ext = DiskCache.formats[format]
+        self.lock = threading.Lock()
+        self.index = None
+        self.size = 0
+        os.makedirs(cache_dir,exist_ok=True)
+
+    def path(self,key):
+        return os.path.join(self.cache_dir,key[:2],key+self.ext)
+
+    def _scan(self):
+        files = []
+        for d in os.scandir(self.cache_dir):
+            if not d.is_dir():
+                continue
+            for f in os.scandir(d.path):
+                if f.name.endswith(self.ext):
+                    st = f.stat()
+                    files.append((st.st_mtime,f.path,st.st_size))
+        files.sort()
+        self.index = collections.OrderedDict((p,s) for _,p,s in files)
+        self.size = sum(self.index.values())
+
+    def get(self,key):
+        """
+        Get cached value for a given key
+        :return: numpy array, or `None` if key is not in cache
+        """
+        fn = self.path(key)
+        try:
+            if self.format=='npz':
+                with np.load(fn) as f:
+                    res = f['arr_0']
+            else:
+                res = np.load(fn,mmap_mode=self.mmap_mode)
+        except FileNotFoundError:
+            return None
+        if self.max_size is not None:
+            with self.lock:
+                if self.index is None:
+                    self._scan()
+                if fn in self.index:
+                    self.index.move_to_end(fn)
+            try:
+                os.utime(fn)
+            except OSError:
+                pass
+        return res
+
+    def put(self,key,value):
+        """
+        Store value in the cache, evicting least recently used entries if cache size goes over `max_size`
+        """
+        fn = self.path(key)
+        os.makedirs(os.path.dirname(fn),exist_ok=True)
+        tmp = "{}.{}.{}.tmp".format(fn,os.getpid(),threading.get_ident())
+        with open(tmp,'wb') as f:
+            if self.format=='npz':
+                np.savez_compressed(f,value)
+            else:
+                np.save(f,value)
+        os.replace(tmp,fn)
+        if self.max_size is not None:
+            with self.lock:
+                if self.index is None:
+                    self._scan()
+                self.size -= self.index.pop(fn,0)
+                self.index[fn] = os.path.getsize(fn)
+                self.size += self.index[fn]
+                while self.size>self.max_size and len(self.index)>1:
+                    p,s = self.index.popitem(last=False)
+                    self.size -= s
+                    try:
+                        os.remove(p)
+                    except FileNotFoundError:
+                        pass
+
+class LRUCache:
+    """
+    Thread-safe in-memory cache with a capacity in bytes and least recently used eviction policy. Size of numpy arrays
+    is taken from `nbytes`, for other objects `sys.getsizeof` is used.
+    """
+
+    def __init__(self,capacity=1<<30):
+        """
+        Create in-memory cache
+        :param capacity: Maximum total size of the cached values in bytes. Defaults to 1 Gb.
+        """
+        self.capacity = capacity
+        self.data = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def sizeof(value):
+        return value.nbytes if isinstance(value,np.ndarray) else sys.getsizeof(value)
+
+    def get(self,key,default=None):
+        """
+        Get the value for a given key, marking it as recently used
+        :return: cached value, or `default` if key is not in cache
+        """
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key][0]
+            self.misses += 1
+            return default
+
+    def put(self,key,value):
+        """
+        Store the value in the cache, evicting least recently used values if needed. Values bigger than the capacity
+        of the cache are not stored.
+        """
+        sz = LRUCache.sizeof(value)
+        with self.lock:
+            if key in self.data:
+                self.size -= self.data.pop(key)[1]
+            if sz>self.capacity:
+                return
+            self.data[key] = (value,sz)
+            self.size += sz
+            while self.size>self.capacity:
+                _,(_,s) = self.data.popitem(last=False)
+                self.size -= s
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+    def __contains__(self,key):
+        with self.lock:
+            return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        """
+        Return cache statistics as a dictionary
+        """
+        return { 'hits' : self.hits, 'misses' : self.misses, 'items' : len(self.data), 'size' : self.size, 'capacity' : self.capacity }
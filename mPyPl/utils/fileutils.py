@@ -4,6 +4,10 @@
 import os
 from pipe import *
 import functools 
+import pickle
+import threading
+import time
+from .cache import hash_value
 
 def readlines(fn):
     """
@@ -64,17 +68,113 @@ def write_dict_text(fn,dict):
 
 # Directory manipulations
 
-def get_files(data_dir, ext=None):
+def _scandir(path):
+    """
+    Internal. Return lists of names of files and subdirectories of the directory. Entry types are obtained from
+    `os.scandir` without additional `stat` calls on most platforms, symbolic links are followed.
+    """
+    files, dirs = [], []
+    with os.scandir(path) as it:
+        for e in it:
+            if e.is_dir():
+                dirs.append(e.name)
+            elif e.is_file():
+                files.append(e.name)
+    return files, dirs
+
+class ListingCache:
+    """
+    On-disk cache of directory listings. Listing of a directory is reused as long as its modification time does not change,
+    so repeated enumeration of large directory trees only needs one `stat` call per directory. Directories modified
+    less than `mtime_slack` seconds ago are not cached, because file system timestamps may be coarse.
+    """
+    mtime_slack = 2
+
+    def __init__(self,filename):
+        """
+        :param filename: file to store the cache in. It is created on `save()` if it does not exist.
+        """
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.changed = False
+        try:
+            with open(filename,'rb') as f:
+                self.entries = pickle.load(f)
+        except (OSError,EOFError,pickle.UnpicklingError):
+            self.entries = {}
+
+    def scan(self,path):
+        """
+        Return lists of names of files and subdirectories of the directory, using cached listing if it is up to date
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        e = self.entries.get(path)
+        if e is not None and e[0]==st.st_mtime_ns:
+            return e[1], e[2]
+        files, dirs = _scandir(path)
+        if time.time()-st.st_mtime>ListingCache.mtime_slack:
+            with self.lock:
+                self.entries[path] = (st.st_mtime_ns,files,dirs)
+                self.changed = True
+        return files, dirs
+
+    def save(self):
+        """
+        Write the cache to disk, if it has changed
+        """
+        with self.lock:
+            if not self.changed:
+                return
+            tmp = '{}.{}.tmp'.format(self.filename,os.getpid())
+            with open(tmp,'wb') as f:
+                pickle.dump(self.entries,f,pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp,self.filename)
+            self.changed = False
+
+def walk_files(path, ext=None, recursive=False, include_hidden=True, cache=None):
+    """
+    Return the list of files in the directory, optionally including all subdirectories. Based on `os.scandir`, so
+    it does not need to `stat` every file.
+    :param path: Path to the directory
+    :param ext: Extension of files to return, or `None` to return all files
+    :param recursive: Include files from all subdirectories. Symbolic links to directories are followed, but each
+    directory is visited only once, so that cyclic links do not cause infinite loop.
+    :param include_hidden: Include hidden files and directories (whose name starts with `.`)
+    :param cache: `ListingCache` object, or name of the cache file to reuse listings of directories that did not change
+    :return: list of file paths (`path` joined with path of the file relative to it)
+    """
+    c = ListingCache(cache) if isinstance(cache,str) else cache
+    res = []
+    stack = [path]
+    visited = set()
+    while len(stack)>0:
+        d = stack.pop()
+        if recursive:
+            st = os.stat(d)
+            if (st.st_dev,st.st_ino) in visited:
+                continue
+            visited.add((st.st_dev,st.st_ino))
+        files, dirs = _scandir(d) if c is None else c.scan(d)
+        res.extend(os.path.join(d,f) for f in files
+                   if (include_hidden or not f.startswith('.')) and (ext is None or f.endswith(ext)))
+        if recursive:
+            stack.extend(os.path.join(d,x) for x in reversed(dirs) if include_hidden or not x.startswith('.'))
+    if isinstance(cache,str):
+        c.save()
+    return res
+
+def get_files(data_dir, ext=None, shard=None, recursive=False, cache=None):
     """
     Get a list of files from the given directory with specified extension
+    :param shard: tuple `(k,n)` to return only files that belong to shard `k` out of `n` (see `in_shard`), or `None`
+    :param recursive: include files from subdirectories
+    :param cache: `ListingCache` object or cache file name (see `walk_files`)
     """
-    if ext is not None:
-        return os.listdir(data_dir) \
-            | where(lambda p: p.endswith(ext)) \
-            | select( lambda p: os.path.join(data_dir,p))
-    else:
-        return os.listdir(data_dir) \
-            | select( lambda p: os.path.join(data_dir,p))
+    files = walk_files(data_dir,ext,recursive,cache=cache)
+    if shard is not None:
+        files = [p for p in files if in_shard(os.path.basename(p),shard)]
+    return files
 
 
 def listdir(path,include_dirs=True,include_files=True,include_hidden=True):
@@ -86,8 +186,52 @@ def listdir(path,include_dirs=True,include_files=True,include_hidden=True):
     :param include_hidden: include hidden files (whose name starts with `.`)
     :return: list of file names
     """
-    return [x for x in os.listdir(path)
-            if ((include_dirs and os.path.isdir(os.path.join(path,x)))
-            or (include_files and os.path.isfile(os.path.join(path,x))))
-            and (include_hidden or not x.startswith('.'))
-           ]
+    with os.scandir(path) as it:
+        return [e.name for e in it
+                if ((include_dirs and e.is_dir()) or (include_files and e.is_file()))
+                and (include_hidden or not e.name.startswith('.'))
+               ]
+
+
+# Sharding of data sources between several nodes
+
+def in_shard(key,shard):
+    """
+    Check if an object with a given key (eg. file name) belongs to the shard. Objects are partitioned by stable hash of
+    the key, which does not depend on the process or machine, so all nodes agree on the partitioning.
+    :param key: key of the object
+    :param shard: tuple `(k,n)`, where `n` is the number of shards and `k` is the current shard (from 0 to n-1), or `None`
+    :return: `True` if object belongs to shard `k`, or if `shard` is `None`
+    """
+    if shard is None:
+        return True
+    k,n = shard
+    return int(hash_value(key)[:16],16)%n==k
+
+def byte_range(fn,shard):
+    """
+    Return byte range `(start,end)` of the file that corresponds to a shard `(k,n)`, by splitting the file into `n`
+    parts of approximately equal size
+    """
+    size = os.path.getsize(fn)
+    k,n = shard
+    return size*k//n, size*(k+1)//n
+
+def byte_range_lines(f,start,end):
+    """
+    Iterate over lines of binary file `f` that start within byte range `[start,end)`. Lines that cross range boundaries
+    belong to the range in which they start, so that splitting the file into adjacent ranges gives each line exactly once.
+    Reading starts from the current position of the file if it is after `start` (eg. when header has been read).
+    :param f: file opened in binary mode
+    :param start: start of the byte range
+    :param end: end of the byte range
+    :return: sequence of lines (as `bytes`)
+    """
+    if start>f.tell():
+        f.seek(start-1)
+        f.readline() # skip to the beginning of the next line
+    while f.tell()<end:
+        l = f.readline()
+        if not l:
+            break
+        yield l
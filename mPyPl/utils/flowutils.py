@@ -43,4 +43,30 @@ def zero_pad(matrix, shape):
     st = shape[0] - matrix.shape[0]
     col = shape[1] - matrix.shape[1]
     zs = shape[2] - matrix.shape[2]
-    return np.pad(matrix, ((0, st), (0, col), (0, zs)), 'constant', constant_values=(0))
\ No newline at end of file
+    return np.pad(matrix, ((0, st), (0, col), (0, zs)), 'constant', constant_values=(0))
+
+def npy_sliding_window(seq,size,stride=1,copy=False):
+    """
+    Produce sliding windows of `size` consecutive elements of a sequence of numpy arrays, stacked into one array.
+    Elements are kept in a mirrored ring buffer of the source dtype, so that each window is a contiguous view into the
+    buffer and no data is moved when the window slides.
+    **Important**: unless `copy=True`, each window is only valid until the next one is produced.
+    :param seq: Sequence of numpy arrays of the same shape
+    :param size: Size of the window (number of elements)
+    :param stride: Number of elements between the starts of consecutive windows
+    :param copy: Return a copy of each window instead of a view
+    :return: Sequence of arrays of shape `(size,)+element_shape`
+    """
+    buf = None
+    n = 0
+    for x in seq:
+        if buf is None:
+            x = np.asarray(x)
+            buf = np.empty((2*size,)+x.shape,dtype=x.dtype)
+        p = n%size
+        buf[p] = x
+        buf[p+size] = x
+        n+=1
+        if n>=size and (n-size)%stride==0:
+            p = n%size
+            yield buf[p:p+size].copy() if copy else buf[p:p+size]
@@ -1,9 +1,12 @@
 # mPyPl - Monadic Pipeline Library for Python
 # http://github.com/shwars/mPyPl
 
+import os
+import struct
+import threading
+import concurrent.futures
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 from .coreutils import entuple,enlist
 from math import ceil
 
@@ -71,16 +74,74 @@ def im_resize(frame,size):
     else:
         return frame
 
-def im_load(fn,size=None,pad_color=None,color_conv=True):
+def jpeg_size(fn):
+    """
+    Get the size of JPEG image from its header, without decoding the image
+    :param fn: Filename
+    :return: Tuple `(width,height)`, or `None` if the file is not a JPEG image
+    """
+    with open(fn,'rb') as f:
+        if f.read(2)!=b'\xff\xd8':
+            return None
+        while True:
+            b = f.read(1)
+            while b and b!=b'\xff':
+                b = f.read(1)
+            while b==b'\xff':
+                b = f.read(1)
+            if not b:
+                return None
+            m = b[0]
+            if m==0x01 or 0xd0<=m<=0xd8: # markers without length
+                continue
+            l = f.read(2)
+            if len(l)<2:
+                return None
+            if 0xc0<=m<=0xcf and m not in (0xc4,0xc8,0xcc): # start of frame
+                d = f.read(5)
+                if len(d)<5:
+                    return None
+                h,w = struct.unpack('>xHH',d)
+                return w,h
+            f.seek(struct.unpack('>H',l)[0]-2,1)
+
+__reduced_flags = { 2 : cv2.IMREAD_REDUCED_COLOR_2, 4 : cv2.IMREAD_REDUCED_COLOR_4, 8 : cv2.IMREAD_REDUCED_COLOR_8 }
+
+def reduction_factor(image_size,size):
+    """
+    Find the largest factor (1, 2, 4 or 8), by which the image can be downscaled while decoding, so that it is still
+    not smaller than the target size. Since EXIF orientation can swap image dimensions, smaller dimension of the reduced
+    image should be not less than larger dimension of the target size.
+    :param image_size: Size of the source image `(width,height)`
+    :param size: Target size, as in `im_load`
+    :return: Reduction factor
+    """
+    dims = [x for x in entuple(size) if x] if size is not None else []
+    if len(dims)==0:
+        return 1
+    t = max(dims)
+    for f in [8,4,2]:
+        if min(ceil(image_size[0]/f),ceil(image_size[1]/f))>=t:
+            return f
+    return 1
+
+def im_load(fn,size=None,pad_color=None,color_conv=True,reduced=True):
     """
         Load image from disk, resize and prepare for NN training
     :param fn: Filename
     :param size: Size of the image (tuple). If not speficied, resizing is not performed
     :param pad_color: Use padding with specified color when resizing. If None, image is stretched
     :param color_conv: Use BGR2RGB color conversion.
+    :param reduced: If target size is much smaller than the size of JPEG image, the image is downscaled by the decoder
+    by a factor of 2, 4 or 8 (see `reduction_factor`), which is much faster than decoding full image
     :return: Image array
     """
-    im = cv2.imread(fn)
+    flags = cv2.IMREAD_COLOR
+    if reduced and size is not None:
+        sz = jpeg_size(fn) if os.path.isfile(fn) else None
+        if sz is not None:
+            flags = __reduced_flags.get(reduction_factor(sz,size),flags)
+    im = cv2.imread(fn,flags)
     if im is None:
         raise(Exception(f'Cannot open {fn}'))
     if color_conv:
@@ -92,6 +153,53 @@ def im_load(fn,size=None,pad_color=None,color_conv=True):
             im = im_resize(im,size)
     return im
 
+def __image_shape(size,pad_color):
+    """
+    Internal. Compute `(H,W)` shape of the image produced by `im_load` with given `size` and `pad_color`
+    """
+    a,b = entuple(size)
+    if a is None or b is None:
+        raise ValueError("Both dimensions of size should be specified")
+    return (a,b) if pad_color is not None else (b,a)
+
+__pools = {}
+__pools_lock = threading.Lock()
+
+def __pool(workers):
+    """
+    Internal. Return thread pool with given number of workers, which is reused between calls
+    """
+    with __pools_lock:
+        if workers not in __pools:
+            __pools[workers] = concurrent.futures.ThreadPoolExecutor(workers)
+        return __pools[workers]
+
+def im_load_batch(fns,size,pad_color=None,color_conv=True,workers=None,out=None):
+    """
+    Load a batch of images in parallel and put them into one array. Images are decoded on a thread pool (OpenCV
+    releases GIL while decoding). Can be used with `apply_batch` to load images for NN training, eg.
+    `apply_batch('filename','image',lambda x: im_load_batch(x,(150,150)))`
+    :param fns: List of filenames
+    :param size: Size of images (tuple), both dimensions should be specified. Meaning is the same as for `im_load`
+    :param pad_color: Use padding with specified color when resizing. If None, image is stretched
+    :param color_conv: Use BGR2RGB color conversion
+    :param workers: Number of threads, defaults to number of CPUs
+    :param out: Optional preallocated `uint8` array of shape `(N,H,W,3)` to store the images
+    :return: Array of shape `(N,H,W,3)`
+    """
+    h,w = __image_shape(size,pad_color)
+    if out is None:
+        out = np.empty((len(fns),h,w,3),dtype=np.uint8)
+    elif out.shape!=(len(fns),h,w,3):
+        raise ValueError("Wrong shape of output array: {}, should be {}".format(out.shape,(len(fns),h,w,3)))
+
+    def load(i):
+        out[i] = im_load(fns[i],size,pad_color,color_conv)
+
+    for f in [__pool(workers or os.cpu_count() or 1).submit(load,i) for i in range(len(fns))]:
+        f.result()
+    return out
+
 def show_images(images, cols = 1, titles = None):
     """
     Show a list of images using matplotlib
@@ -99,6 +207,7 @@ def show_images(images, cols = 1, titles = None):
     :param cols: number of columns to use
     :param titles: list of titles to use or None
     """
+    import matplotlib.pyplot as plt # imported here, because importing matplotlib is slow
     assert((titles is None)or (len(images) == len(titles)))
     if not isinstance(images,list):
         images = list(images)
@@ -2,6 +2,11 @@ from pipe import *
 import random, itertools
 import numpy as np
 import pickle
+import threading
+import queue
+import sys
+import os
+import tempfile
 
 
 @Pipe
@@ -21,6 +26,7 @@ def pshuffle(l):
     """
     Shuffle a given pipe.
     In the current implementation, it has to store the whole datastream into memory as a list, in order to perform shuffle.
+    For big datastreams, consider using `buffer_shuffle` or `disk_shuffle` instead.
     Please not, that the idiom [1,2,3] | pshuffle() | pcycle() will return the same order of the shuffled sequence (eg. something
     like [2,1,3,2,1,3,...]), if you want proper infinite shuffle use `infshuffle()` instead.
     :param l: input pipe generator
@@ -42,7 +48,8 @@ def pcycle(l):
 @Pipe
 def infshuffle(l):
     """
-    Function that turns sequence into infinite shuffled sequence. It loads it into memory for processing.
+    Function that turns sequence into infinite shuffled sequence. It loads it into memory for processing. For big
+    datastreams, `disk_shuffle(epochs=None)` can be used instead.
     :param l: input pipe generator
     :return: result sequence
     """
@@ -52,6 +59,96 @@ def infshuffle(l):
         for x in data:
             yield x
 
+def _epoch_random(seed,epoch):
+    """
+    Internal. Create random generator for a given seed and epoch, so that each epoch gets different but reproducible order.
+    """
+    return random.Random() if seed is None else random.Random('{}-{}'.format(seed,epoch))
+
+@Pipe
+def buffer_shuffle(l,buffer_size=1000,seed=None,epoch=0):
+    """
+    Approximately shuffle a stream using fixed-size buffer. Elements are accumulated into the buffer, and then each new
+    element replaces a randomly chosen one, which is passed downstream. Only `buffer_size` elements are kept in memory,
+    but elements cannot move too far from their original position, so the buffer should be big compared to the
+    length of runs of similar elements (eg. of the same class) in the input.
+    :param l: input pipe generator
+    :param buffer_size: size of the buffer
+    :param seed: random seed. If `None`, order is not reproducible
+    :param epoch: epoch number, which is combined with `seed` to get different order for each epoch
+    :return: shuffled sequence
+    """
+    rnd = _epoch_random(seed,epoch)
+    buf = []
+    for x in l:
+        if len(buf)<buffer_size:
+            buf.append(x)
+        else:
+            i = rnd.randrange(buffer_size)
+            yield buf[i]
+            buf[i] = x
+    rnd.shuffle(buf)
+    for x in buf:
+        yield x
+
+@Pipe
+def disk_shuffle(l,shards=16,seed=None,epochs=1,tmp_dir=None):
+    """
+    Shuffle a stream that does not fit into memory. In the first pass, elements are pickled into `shards` temporary files,
+    each element going to a random shard. In the second pass, shards are read one by one in random order and shuffled in
+    memory, which gives a uniformly random permutation. When several epochs are requested, elements are re-scattered
+    into new shards during each pass, so that every epoch is an independent permutation. Only one shard is kept in memory at a time, so the number
+    of shards should be chosen so that `len(stream)/shards` elements fit into memory. Elements should be picklable,
+    i.e. lazy fields should be evaluated before shuffling.
+    :param l: input pipe generator
+    :param shards: number of shards
+    :param seed: random seed. If `None`, order is not reproducible
+    :param epochs: number of passes over the shuffled data, each in a different order. `None` means infinite sequence.
+    The input stream is consumed only once.
+    :param tmp_dir: directory for temporary files. Defaults to system temp directory
+    :return: shuffled sequence
+    """
+    with tempfile.TemporaryDirectory(prefix='mpypl-shuffle-',dir=tmp_dir) as d:
+        fnames = [[os.path.join(d,'shard{}-{}.pkl'.format(g,i)) for i in range(shards)] for g in range(2)]
+        files = [open(fn,'wb') for fn in fnames[0]]
+        try:
+            rnd = _epoch_random(seed,'split')
+            for x in l:
+                pickle.dump(x,files[rnd.randrange(shards)],pickle.HIGHEST_PROTOCOL)
+        finally:
+            for f in files:
+                f.close()
+        epoch = 0
+        while epochs is None or epoch<epochs:
+            # while reading shards of this epoch, elements are scattered into new shards for the next one,
+            # so that each epoch is an independent permutation
+            last = epochs is not None and epoch==epochs-1
+            cur, nxt = fnames[epoch%2], fnames[(epoch+1)%2]
+            files = [] if last else [open(fn,'wb') for fn in nxt]
+            try:
+                split_rnd = _epoch_random(seed,'split-{}'.format(epoch+1))
+                rnd = _epoch_random(seed,epoch)
+                order = list(range(shards))
+                rnd.shuffle(order)
+                for i in order:
+                    data = []
+                    with open(cur[i],'rb') as f:
+                        while True:
+                            try:
+                                data.append(pickle.load(f))
+                            except EOFError:
+                                break
+                    rnd.shuffle(data)
+                    for x in data:
+                        if not last:
+                            pickle.dump(x,files[split_rnd.randrange(shards)],pickle.HIGHEST_PROTOCOL)
+                        yield x
+                    data = None
+            finally:
+                for f in files:
+                    f.close()
+            epoch += 1
+
 @Pipe
 def pexec(l,func=None,convert_to_list=False):
     """
@@ -157,7 +254,9 @@ def first(l):
 @Pipe
 def psave(datastream,filename):
     """
-    Save whole datastream into a file for later use
+    Save whole datastream into a file for later use. The datastream is loaded into memory and pickled as one list,
+    so for large datasets (eg. precomputed features) use `write_records`, which writes records one by one into sharded
+    files that can be streamed or accessed by index.
     :param datastream: Datastream
     :param filename: Filename
     """
@@ -167,7 +266,7 @@ def psave(datastream,filename):
 
 def pload(filename):
     """
-    Load a datastream (list) from file and use it as a pipe
+    Load a datastream (list) from file and use it as a pipe. See `read_records` for reading large datasets.
     :param filename: filename to use
     :return: datastream (list)
     """
@@ -175,6 +274,61 @@ def pload(filename):
         ls = pickle.load(input)
     return ls
 
+@Pipe
+def prefetch(l,n=10):
+    """
+    Compute upstream elements of the pipe on a background thread, keeping at most `n` of them ready in a queue.
+    This allows I/O-bound stages (eg. loading images) to overlap with the consumer (eg. training on GPU):
+    `get_datastream(...) | apply('filename','image',im_load) | prefetch(32) | as_batch(...)`
+    Exceptions raised upstream are re-raised in the consumer. If the consumer stops early (eg. with `take` or `first`),
+    the background thread is stopped as well, and the upstream generator is closed.
+    :param l: input pipe generator
+    :param n: maximum number of elements to prefetch
+    :return: the same sequence
+    """
+    q = queue.Queue(maxsize=n)
+    stop = threading.Event()
+    done = object()
+
+    def put(x):
+        while not stop.is_set():
+            try:
+                q.put(x,timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        it = None
+        try:
+            it = iter(l)
+            for x in it:
+                if not put((x,None)):
+                    return
+        except BaseException:
+            put((done,sys.exc_info()[1]))
+            return
+        finally:
+            # release upstream resources (open files, nested prefetch threads) when the consumer stops early
+            if hasattr(it,'close'):
+                it.close()
+        put((done,None))
+
+    t = threading.Thread(target=worker,daemon=True)
+    t.start()
+    try:
+        while True:
+            x, e = q.get()
+            if x is done:
+                if e is not None:
+                    raise e
+                return
+            yield x
+    finally:
+        stop.set()
+        t.join()
+
 @Pipe
 def execute(l):
     """
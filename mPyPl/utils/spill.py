@@ -0,0 +1,149 @@
+# mPyPl - Monadic Pipeline Library for Python
+# http://github.com/shwars/mPyPl
+
+# Out-of-core storage of grouped records
+
+import sys
+import pickle
+import tempfile
+from array import array
+import numpy as np
+
+def record_size(x,seen=None):
+    """
+    Estimate memory size of a record (`mdict` or any object) in bytes. Lists, tuples, dictionaries (including nested
+    `mdict`s) are traversed recursively, size of numpy arrays is taken from `nbytes`, and objects referenced more than
+    once are counted once.
+    """
+    if seen is None:
+        seen = set()
+    if id(x) in seen:
+        return 0
+    seen.add(id(x))
+    s = sys.getsizeof(x)
+    if isinstance(x,np.ndarray):
+        return s if x.base is None else s+x.nbytes # size of array that owns its data already includes it
+    if isinstance(x,(list,tuple,set,frozenset)):
+        return s+sum(record_size(v,seen) for v in x)
+    if isinstance(x,dict):
+        return s+sum(record_size(k,seen)+record_size(v,seen) for k,v in x.items())
+    if hasattr(x,'keys') and hasattr(x,'values'): # cmdict
+        return s+sum(record_size(v,seen) for v in x.values())
+    return s
+
+class GroupView:
+    """
+    Sequence of records of one group in `SpillGroups`, which supports `len`, indexing and iteration
+    """
+    def __init__(self,groups,key):
+        self.groups = groups
+        self.key = key
+
+    def __len__(self):
+        return self.groups.count(self.key)
+
+    def __getitem__(self,i):
+        if i<0:
+            i += len(self)
+        if i<0 or i>=len(self):
+            raise IndexError(i)
+        return self.groups.get(self.key,i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.groups.get(self.key,i)
+
+class SpillGroups:
+    """
+    Dictionary of lists of records, which keeps records in memory up to a given budget (in bytes), and spills the
+    biggest groups to a temporary file when the budget is exceeded. Spilled records are read back by index, so
+    groups can be accessed in any order. Records should be picklable.
+    """
+    def __init__(self,memory_budget,tmp_dir=None):
+        """
+        :param memory_budget: maximum estimated size of records kept in memory, in bytes
+        :param tmp_dir: directory for the temporary file. Defaults to system temp directory
+        """
+        self.memory_budget = memory_budget
+        self.tmp_dir = tmp_dir
+        self.memory = {}
+        self.offsets = {}
+        self.sizes = {}
+        self.total = 0
+        self.file = None
+
+    def add(self,key,x):
+        """
+        Add record `x` to the group `key`
+        """
+        if key not in self.memory:
+            self.memory[key] = []
+            self.offsets[key] = array('q')
+            self.sizes[key] = 0
+        self.memory[key].append(x)
+        sz = record_size(x)
+        self.sizes[key] += sz
+        self.total += sz
+        while self.total>self.memory_budget:
+            self.spill(max(self.sizes,key=self.sizes.get))
+
+    def spill(self,key):
+        """
+        Move in-memory records of group `key` to disk
+        """
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(prefix='mpypl-spill-',dir=self.tmp_dir)
+        f = self.file
+        f.seek(0,2)
+        offs = self.offsets[key]
+        for x in self.memory[key]:
+            offs.append(f.tell())
+            pickle.dump(x,f,pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        self.memory[key] = []
+        self.total -= self.sizes[key]
+        self.sizes[key] = 0
+
+    def count(self,key):
+        return len(self.offsets[key])+len(self.memory[key])
+
+    def get(self,key,i):
+        """
+        Get `i`-th record of the group `key`
+        """
+        offs = self.offsets[key]
+        if i<len(offs):
+            self.file.seek(offs[i])
+            return pickle.load(self.file)
+        return self.memory[key][i-len(offs)]
+
+    def spilled(self):
+        """
+        Return number of records stored on disk
+        """
+        return sum(len(x) for x in self.offsets.values())
+
+    def keys(self):
+        return self.memory.keys()
+
+    def __contains__(self,key):
+        return key in self.memory
+
+    def __getitem__(self,key):
+        if key not in self.memory:
+            raise KeyError(key)
+        return GroupView(self,key)
+
+    def items(self):
+        return [(k,GroupView(self,k)) for k in self.memory.keys()]
+
+    def __len__(self):
+        return len(self.memory)
+
+    def close(self):
+        """
+        Remove temporary file
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -2,56 +2,93 @@ import numpy as np
 import cv2
 from os.path import *
 import math
+from .cache import LRUCache
 
-# trs, let's assume width is always wider than height
-def video_to_npy(infile, outfile=None, width=None,  height=None, squarecrop=None, fps=None, mode='rgb', maxlength=None, use_cache=False):
-
-    global vcache
+"""
+Default in-memory cache of decoded videos used by `video_to_npy` when `use_cache=True`. Its capacity (in bytes) can be
+changed by setting `video_cache.capacity`, and hit/miss counters are available through `video_cache.stats()`.
+"""
+video_cache = LRUCache()
 
-    if use_cache and outfile is not None and 'vcache' in globals():
-        if outfile in vcache: return vcache[outfile]
-    else:
-        vcache = dict()
+# trs, let's assume width is always wider than height
+def video_to_npy(infile, outfile=None, width=None,  height=None, squarecrop=None, fps=None, mode='rgb', maxlength=None, use_cache=False, mmap_mode=None):
+    """
+    Load video file into `np.array` of frames, optionally resizing, cropping and subsampling it.
+    :param infile: input video file
+    :param outfile: `.npy` file to store decoded video in. If it exists, video is loaded from it
+    :param use_cache: if `True`, decoded videos are kept in the in-memory `video_cache`. An instance of `LRUCache`
+    can also be passed to use a specific cache
+    :param mmap_mode: if not `None`, `outfile` is opened memory-mapped with this mode
+    :return: video as `np.array` of shape `(frames,height,width,channels)`
+    """
+    cache = None
+    if isinstance(use_cache,LRUCache) or use_cache is True: # LRUCache defines __len__, so empty cache is falsy
+        cache = use_cache if isinstance(use_cache,LRUCache) else video_cache
+        key = (outfile,) if outfile is not None else (infile,width,height,squarecrop,fps,mode,maxlength)
+        frames = cache.get(key)
+        if frames is not None:
+            return frames
 
     # has this video already been saved before?
     if outfile and isfile(outfile):
-        frames = np.load(outfile)
+        frames = np.load(outfile,mmap_mode=mmap_mode)
 
-        if use_cache: vcache[outfile] = frames
+        if cache is not None: cache.put(key,frames)
         # just return this preloaded video
         return frames
     
     print('reading fresh video from %s' % infile)
     vidcap = cv2.VideoCapture(infile)
     success, image = vidcap.read()
-    
-    frames = []
-    count = 0
     if not success:
         raise ValueError('Could not read the video file!')
-    while success:
-        frames.append( image[...,::-1] if mode == 'rgb' else image )
-        count += 1
-        success,image = vidcap.read()
-    if fps:
-        span = int(vidcap.get(cv2.CAP_PROP_FPS) / fps)
-        frames = frames[0::span] 
-    if width or height:  
-        width = width if width else int(height / frames[0].shape[0] * frames[0].shape[1])
-        height = height if height else int(width / frames[0].shape[1] * frames[0].shape[0])
-        frames = [ cv2.resize(frame, (width, height)) for frame in frames ]
+
+    # frames are decoded in a streaming manner: skipped frames are only grabbed, not decoded into images,
+    # and decoding stops as soon as `maxlength` is reached
+    src_fps = vidcap.get(cv2.CAP_PROP_FPS)
+    span = max(1,int(src_fps / fps)) if fps else 1
+    limit = int(maxlength*(fps if fps else src_fps)) if maxlength else None
+    if width or height:
+        width = width if width else int(height / image.shape[0] * image.shape[1])
+        height = height if height else int(width / image.shape[1] * image.shape[0])
+    else:
+        height, width = image.shape[:2]
     if squarecrop:
         tl = int((width/2)-(height/2))
-        # note that x,y is the wrong way around i.e. it's
-        # F x Y x X x C
-        frames = [ frame[ 0:height, tl:(tl+height)] for frame in frames ]
-    # trs-renamed this from "cropat" as it's a more intuative name
-    if maxlength:
-        frames = frames[0:maxlength*fps]
-        
-    frames = np.array(frames)
+    # note that x,y is the wrong way around i.e. it's
+    # F x Y x X x C
+    frame_shape = (height, height if squarecrop else width) + image.shape[2:]
+
+    total = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+    n = (total+span-1)//span if total>0 else 64
+    if limit is not None:
+        n = min(n,limit)
+    frames = np.empty((max(n,1),)+frame_shape,dtype=image.dtype)
+    count = 0
+    while success:
+        if count==frames.shape[0]: # frame count reported by the container was wrong
+            frames = np.concatenate([frames,np.empty_like(frames)])
+        if image.shape[:2]!=(height,width):
+            image = cv2.resize(image, (width, height))
+        if squarecrop:
+            image = image[ 0:height, tl:(tl+height)]
+        frames[count] = image[...,::-1] if mode == 'rgb' else image
+        count += 1
+        if limit is not None and count>=limit:
+            break
+        for _ in range(span-1):
+            if not vidcap.grab():
+                break
+        success, image = vidcap.read()
+    vidcap.release()
+    if count<frames.shape[0]:
+        frames = frames[:count].copy()
+
     if outfile:
         np.save(outfile, frames)
+        if mmap_mode is not None:
+            frames = np.load(outfile,mmap_mode=mmap_mode)
+    if cache is not None: cache.put(key,frames)
     return frames
 
 def resize_video(video, video_size=(100,100)):
@@ -1,16 +1,19 @@
 # Video processing functions
 from .utils.video import *
+from .utils.flowutils import npy_sliding_window
 from .utils.image import im_resize
 from pipe import Pipe
 from PIL import Image
 from PIL import GifImagePlugin
 
 
-def load_video(video, video_size=(100,100), squarecrop=False, fps=25, maxlength=5, use_cache=False):
+def load_video(video, video_size=(100,100), squarecrop=False, fps=25, maxlength=5, use_cache=False, outfile=None, mmap_mode=None):
     """
     Load video content into `np.array.`. This is most frequently used to load video files for further processing in a
     pipeline like this:
     `get_datastream(...) | apply('filename','video',load_video) | ...`
+    If `outfile` is given, decoded video is cached in this `.npy` file, and `mmap_mode` (eg. `'r'`) can be used to open
+    it memory-mapped instead of reading it into memory.
     """
     return video_to_npy(
         video,
@@ -19,7 +22,9 @@ def load_video(video, video_size=(100,100), squarecrop=False, fps=25, maxlength=
         squarecrop=squarecrop,
         fps=fps,
         maxlength=maxlength,
-        use_cache=use_cache
+        use_cache=use_cache,
+        outfile=outfile,
+        mmap_mode=mmap_mode
     )
 
 def videosource(fname,video_size=(100,100),mode='rgb'):
@@ -41,41 +46,34 @@ def videosource(fname,video_size=(100,100),mode='rgb'):
         success, image = vidcap.read()
 
 
-def videosource_chunked(fname,frames_per_chunk=25,video_size=(100,100),mode='rgb'):
+def videosource_chunked(fname,frames_per_chunk=25,video_size=(100,100),mode='rgb',stride=None,copy=True):
     """
-    Produce a stream of video chunks of a given size.
+    Produce a stream of video chunks of a given size. Chunks keep the dtype of the video frames (`uint8`).
     :param fname: input filename
     :param frames_per_chunk: number of frames per chunk. Defaults to 25, meaning 1 second of video under 25 fps.
     :param video_size: tuple showing the size of the video frames `(width,height)`
     :param mode: mode used to open the file. Default is `'rgb'`
+    :param stride: number of frames between the starts of consecutive chunks. Defaults to `frames_per_chunk`, i.e. non-overlapping chunks
+    :param copy: if `False`, chunks are views into internal ring buffer, which are only valid until the next chunk is produced
     :return: pipe stream of video chunks
     """
-    vidcap = cv2.VideoCapture(fname)
-    success, image = vidcap.read()
-    i = 0
-    # TODO: We assume that video is color
-    chunk = np.zeros((frames_per_chunk,video_size[1],video_size[0],3))
-    if not success:
-        raise ValueError('Could not read the video file!')
-    while success:
-        im=im_resize((image[..., ::-1] if mode == 'rgb' else image),video_size)
-        chunk[i] = im
-        i+=1
-        if i==frames_per_chunk:
-            yield chunk
-            i=0
-            chunk = np.zeros((frames_per_chunk, video_size[1], video_size[0], 3)) # TODO: Color!
-        success, image = vidcap.read()        
+    return npy_sliding_window(videosource(fname,video_size,mode),frames_per_chunk,
+                              stride=frames_per_chunk if stride is None else stride,copy=copy)
 
 @Pipe
-def chunk_slide(datastream, chunk_size):
-    # preload into memory
-    # TODO: this will throw exception if windows size is smaller than first chunk
-    mem = np.array([next(datastream) for _ in range(chunk_size)])
-    for x in datastream:
-        yield mem.reshape((-1,)+x.shape[-3:]).copy()
-        mem = np.roll(mem, -1, axis=0)
-        mem[-1] = x
+def chunk_slide(datastream, chunk_size, stride=1, copy=False):
+    """
+    Produce sliding windows over a stream of video frames or chunks. Each window contains `chunk_size` consecutive
+    elements of the stream, concatenated along the frame axis.
+    :param datastream: stream of frames or video chunks
+    :param chunk_size: number of elements of the stream in one window
+    :param stride: number of elements between the starts of consecutive windows. Defaults to 1
+    :param copy: if `False` (default), windows are views into internal ring buffer, which are only valid until the next
+    window is produced. Use `copy=True` if you need to keep them
+    :return: stream of windows of shape `(frames,height,width,channels)`, with the dtype of the source
+    """
+    for w in npy_sliding_window(datastream,chunk_size,stride=stride,copy=copy):
+        yield w.reshape((-1,)+w.shape[-3:])
 
 @Pipe
 def collect_video(datastream,filename,video_size=None,codec=cv2.VideoWriter_fourcc(*"ffds")):
@@ -4,6 +4,40 @@
 import os
 import xml.etree.ElementTree as et
 from .mdict import *
+from .utils.fileutils import in_shard
+from .core import as_field, papply, select_field
+import functools
+
+def __addf(md,n,x,list_fields):
+    """
+    Internal. Add field `n` with value `x` to `md`, turning it into a list if the value already exists
+    """
+    if n in md:
+        v = md[n]
+        if isinstance(v,list):
+            v.append(x)
+        else:
+            md[n] = [v,x]
+    else:
+        md[n] = [x] if n in list_fields else x
+
+def __populate(xml,m,prefix,list_fields,flatten_fields,skip_fields):
+    """
+    Internal. Implementation of `populate_mdict_from_xml`, where field rules are sets
+    """
+    for x in xml:
+        tag = x.tag
+        if tag in skip_fields:
+            continue
+        if len(x)==0: # atomic value
+            __addf(m,prefix+tag,x.text,list_fields)
+        elif tag in flatten_fields:
+            __populate(x,m,prefix+tag+"_",list_fields,flatten_fields,())
+        else:
+            m1 = mdict()
+            __populate(x,m1,'',list_fields,flatten_fields,())
+            __addf(m,prefix+tag,m1,list_fields)
+    return m
 
 def populate_mdict_from_xml(xml,m, prefix='',list_fields=[],flatten_fields=[],skip_fields=[]):
     """
@@ -12,32 +46,37 @@ def populate_mdict_from_xml(xml,m, prefix='',list_fields=[],flatten_fields=[],sk
     :param prefix: prefix to use for each field (useful for recursive calls)
     :param list_fields: fields to be treated as lists (useful is we know that certain values will be present more than once)
     :param flatten_fields: fields to be flattened
-    :param skip_fields: fields to be skipped
+    :param skip_fields: fields to be skipped (only direct children of `xml` are checked)
     :return: mdict object
     """
-    def addf(md,n,x): # add field n with value x, handle situations when value already exists
-        n = prefix+n
-        if n in md.keys():
-            if isinstance(md[n],list):
-                md[n].append(x)
-            else:
-                md[n] = [md[n],x]
-        else:
-            md[n] = [x] if n in list_fields else x
-    for x in xml:
-        if x.tag in skip_fields:
-            continue
-        if len(x)==0: # atomic value
-            addf(m,x.tag,x.text)
-        else:
-            if x.tag in flatten_fields:
-                populate_mdict_from_xml(x,m,prefix+x.tag+"_",list_fields,flatten_fields)
-            else:
-                m1 = mdict()
-                populate_mdict_from_xml(x,m1,'',list_fields,flatten_fields)
-                addf(m,x.tag,m1)
+    return __populate(xml,m,prefix,frozenset(list_fields),frozenset(flatten_fields),frozenset(skip_fields))
+
+def parse_xml(source,m=None,list_fields=frozenset(),flatten_fields=frozenset(),skip_fields=frozenset()):
+    """
+    Construct `mdict` object from XML file, in the same way as `populate_mdict_from_xml` does for the root element.
+    :param source: filename or file object
+    :param m: `mdict` to populate, or `None` to create a new one
+    :param list_fields: set of fields to be treated as lists
+    :param flatten_fields: set of fields to be flattened
+    :param skip_fields: set of fields (children of the root element) to be skipped
+    :return: mdict object
+    """
+    return __populate(et.parse(source).getroot(),mdict() if m is None else m,'',list_fields,flatten_fields,skip_fields)
 
-def get_xmlstream_from_dir(dir,ext='.xml',list_fields=[],flatten_fields=[],skip_fields=[],populate_aux_fields=False):
+def __parse_xml_files(fns,list_fields,flatten_fields,skip_fields,populate_aux_fields):
+    """
+    Internal. Parse a list of `(filename,path)` pairs. Defined at module level, so that it can be used in a process pool.
+    """
+    res = []
+    for f,fn in fns:
+        m = mdict()
+        if populate_aux_fields:
+            m['__original_filename__'] = f
+            m['__original_filepath__'] = fn
+        res.append(parse_xml(fn,m,list_fields,flatten_fields,skip_fields))
+    return res
+
+def get_xmlstream_from_dir(dir,ext='.xml',list_fields=[],flatten_fields=[],skip_fields=[],populate_aux_fields=False,shard=None,workers=None,ordered=True,chunk_size=64):
     """
     Returns the stream of XML objects retrieved from files in the given directory. This can be used, for example, for
     reading Pascal VOC annotations.
@@ -45,18 +84,23 @@ def get_xmlstream_from_dir(dir,ext='.xml',list_fields=[],flatten_fields=[],skip_
     :param list_fields: fields to be treated as lists (useful is we know that certain values will be present more than once)
     :param flatten_fields: fields to be flattened
     :param skip_fields: fields to be skipped
+    :param shard: tuple `(k,n)` to parse only files that belong to shard `k` out of `n` (see `in_shard`), or `None`
+    :param workers: number of processes to parse files in parallel, or `None` to parse in the current process
+    :param ordered: when parsing in parallel, preserve the order of files. If `False`, objects are returned as soon as they are parsed
+    :param chunk_size: number of files sent to a worker process at once
     :return: A stream of `mdict`s with fields corresponding to XML elements
     """
-    for f in os.listdir(dir):
-        if ext is not None and not f.endswith(ext):
-            continue
-        doc = et.parse(os.path.join(dir,f))
-        m = mdict()
-        if populate_aux_fields:
-            m['__original_filename__'] = f
-            m['__original_filepath__'] = os.path.join(dir,f)
-        populate_mdict_from_xml(doc.getroot(),m,'',list_fields,flatten_fields)
-        yield m
+    func = functools.partial(__parse_xml_files,list_fields=frozenset(list_fields),flatten_fields=frozenset(flatten_fields),
+                             skip_fields=frozenset(skip_fields),populate_aux_fields=populate_aux_fields)
+    fns = [(f,os.path.join(dir,f)) for f in os.listdir(dir)
+           if (ext is None or f.endswith(ext)) and in_shard(f,shard)]
+    if workers is None:
+        for x in fns:
+            yield from func([x])
+        return
+    chunks = [fns[i:i+chunk_size] for i in range(0,len(fns),chunk_size)]
+    for res in chunks | as_field('files') | papply('files','res',func,workers=workers,mode='process',ordered=ordered) | select_field('res'):
+        yield from res
 
 def get_pascal_annotations(dir='Annotations',ext='.xml',skip_fields=[]):
     """